@@ -1,32 +1,53 @@
-import os
-from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-# Load environment variables from .env file if it exists
-load_dotenv()
+class Settings(BaseSettings):
+    # Read once from the environment / .env file; frozen so nothing mutates it at runtime
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore", frozen=True)
 
-class Config:
     # API Configuration
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    google_api_key: Optional[str] = None
     
     # Proxy Configuration (Optional)
-    HTTP_PROXY = os.getenv("HTTP_PROXY")
-    HTTPS_PROXY = os.getenv("HTTPS_PROXY")
+    http_proxy: Optional[str] = None
+    https_proxy: Optional[str] = None
     
     # Model Configuration
     # Using Flash for speed as requested for the MVP
-    GEMINI_MODEL_NAME = "gemini-3-flash-preview" 
-    GEMINI_TEXT_MODEL = "gemini-2.5-flash"
-    GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image"
+    gemini_model_name: str = "gemini-3-flash-preview" 
+    gemini_text_model: str = "gemini-2.5-flash"
+    gemini_image_model: str = "gemini-2.5-flash-image"
     
     # Search Configuration
-    ARXIV_MAX_RESULTS = 5
+    arxiv_max_results: int = 5
+    
+    # Upload Configuration
+    max_upload_bytes: int = 50 * 1024 * 1024
     
     # App Configuration
-    PAGE_TITLE = "Daily Paper Reader"
-    PAGE_ICON = "📑"
+    # Externally reachable base URL used to build links to files under /uploads
+    public_base_url: str = "http://127.0.0.1:8000"
+    page_title: str = "Daily Paper Reader"
+    page_icon: str = "📑"
+
+    def proxy_map(self) -> Dict[str, str]:
+        """
+        Configured proxies keyed by httpx mount pattern, for clients to apply explicitly
+        instead of exporting them to the process environment.
+        """
+        proxies = {}
+        if self.http_proxy:
+            proxies["http://"] = self.http_proxy
+        if self.https_proxy:
+            proxies["https://"] = self.https_proxy
+        return proxies
 
-    @staticmethod
-    def validate():
-        if not Config.GOOGLE_API_KEY:
+    def validate_config(self) -> Tuple[bool, str]:
+        if not self.google_api_key:
             return False, "Google API Key is missing. Please set it in the sidebar or .env file."
         return True, ""
+
+@lru_cache(maxsize=1)
+def settings() -> Settings:
+    return Settings()
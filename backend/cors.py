@@ -0,0 +1,78 @@
+from typing import Iterable
+
+ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+class CORSMiddleware:
+    """
+    Pure ASGI CORS middleware specialised for this app's policy: a fixed list of
+    origins, credentials allowed, any method and any request header.
+
+    Origins are matched against a frozenset of raw header bytes and every static
+    header is encoded once up front, so requests only pay for a tuple scan.
+    """
+
+    def __init__(self, app, allow_origins: Iterable[str], max_age: int = 600):
+        self.app = app
+        self.allow_origins = frozenset(origin.encode("latin-1") for origin in allow_origins)
+        self.preflight_headers = (
+            (b"access-control-allow-methods", ALLOW_METHODS),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            (b"vary", b"Origin"),
+        )
+        self.simple_headers = (
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(origin, request_headers, send)
+            return
+
+        if origin not in self.allow_origins:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((b"access-control-allow-origin", origin))
+                headers.extend(self.simple_headers)
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, origin: bytes, request_headers, send):
+        if origin in self.allow_origins:
+            status, body = 200, b"OK"
+            headers = [(b"access-control-allow-origin", origin), *self.preflight_headers]
+            if request_headers:
+                # Any header is allowed, so echo back whatever the browser asked for
+                headers.append((b"access-control-allow-headers", request_headers))
+        else:
+            status, body = 400, b"Disallowed CORS origin"
+            headers = [(b"vary", b"Origin")]
+
+        headers.append((b"content-type", b"text/plain; charset=utf-8"))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
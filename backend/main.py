@@ -1,23 +1,30 @@
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Depends
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional, Any
-import json
+from functools import lru_cache
+import orjson
 import asyncio
 import os
-import shutil
 import uuid
+import hashlib
+import aiofiles
+import aiofiles.os
 from services.arxiv_fetcher import ArxivFetcher, Paper
 from services.gemini_agent import GeminiAgent
 from services.cache_manager import CacheManager
 from services.user_profile_manager import UserProfileManager
 from services.scheduler_service import SchedulerService
-from config import Config
+from config import settings
+from cors import CORSMiddleware
 
 app = FastAPI(title="Daily Scholar API")
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+PDF_MAGIC = b"%PDF"
+UPLOADS_BASE_URL = f"{settings().public_base_url.rstrip('/')}/uploads"
+
 # Mount uploads directory to serve static files
 os.makedirs("uploads", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
@@ -28,13 +35,8 @@ origins = [
     "http://127.0.0.1:3000",
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Credentials, all methods and all headers are allowed for these origins
+app.add_middleware(CORSMiddleware, allow_origins=origins)
 
 # --- Data Models ---
 class AnalyzeRequest(BaseModel):
@@ -52,30 +54,83 @@ class UploadResponse(BaseModel):
     filename: str
 
 # --- Services ---
-gemini_agent = None
-cache_manager = None
-user_profile_manager = None
+# Each service is built once per process by its cached factory and injected with Depends
+@lru_cache(maxsize=1)
+def get_gemini_agent() -> GeminiAgent:
+    return GeminiAgent()
+
+@lru_cache(maxsize=1)
+def get_cache_manager() -> CacheManager:
+    return CacheManager()
+
+@lru_cache(maxsize=1)
+def get_user_profile_manager() -> UserProfileManager:
+    return UserProfileManager()
+
 scheduler_service = None
 
 @app.on_event("startup")
 def startup_event():
-    global gemini_agent, cache_manager, user_profile_manager, scheduler_service
-    try:
-        Config.validate()
-        gemini_agent = GeminiAgent()
-        cache_manager = CacheManager()
-        user_profile_manager = UserProfileManager()
-        
-        # Initialize and start scheduler
-        scheduler_service = SchedulerService(gemini_agent, user_profile_manager)
-        scheduler_service.start()
-        
-        print("Services initialized successfully.")
-    except Exception as e:
-        print(f"Warning: Failed to initialize services: {e}")
+    global scheduler_service
+    # Refuse to start without a usable configuration, so endpoints can rely on the services existing
+    ok, message = settings().validate_config()
+    if not ok:
+        raise RuntimeError(message)
+
+    gemini_agent = get_gemini_agent()
+    get_cache_manager()
+    user_profile_manager = get_user_profile_manager()
+    
+    # Initialize and start scheduler
+    scheduler_service = SchedulerService(gemini_agent, user_profile_manager)
+    scheduler_service.start()
+    
+    print("Services initialized successfully.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if scheduler_service:
+        scheduler_service.stop()
+    await ArxivFetcher.aclose()
 
 # --- Endpoints ---
 
+# Sentinel pushed onto the SSE progress queue once the worker has finished
+_STREAM_DONE = object()
+
+SSE_PING_SECONDS = 15
+
+@lru_cache(maxsize=1)
+def get_event_source_response():
+    """
+    Returns sse_starlette's EventSourceResponse, or None if the package is not installed.
+    """
+    try:
+        from sse_starlette.sse import EventSourceResponse
+    except ImportError:
+        return None
+    return EventSourceResponse
+
+def sse_response(events):
+    """
+    Wraps an async iterator of JSON-serialisable payloads in an SSE response.
+    Events are unnamed so the frontend keeps receiving them through EventSource.onmessage.
+    """
+    event_source_response = get_event_source_response()
+    if event_source_response is not None:
+        return event_source_response(
+            # sse_starlette frames str data itself
+            ({"data": orjson.dumps(payload).decode()} async for payload in events),
+            ping=SSE_PING_SECONDS,
+        )
+
+    # Fallback: hand-rolled framing without keepalive pings
+    return StreamingResponse(
+        (b"data: " + orjson.dumps(payload) + b"\n\n" async for payload in events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "ok", "message": "Backend is running smoothly"}
@@ -87,21 +142,55 @@ async def upload_file(file: UploadFile = File(...)):
     """
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+    max_bytes = settings().max_upload_bytes
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+    # Reject anything without the PDF magic bytes before touching the disk
+    header = await file.read(len(PDF_MAGIC))
+    if header != PDF_MAGIC:
+        raise HTTPException(status_code=400, detail="Not a PDF file")
     
     try:
-        # Generate a unique filename to prevent collisions
+        # Stream into a temporary file first; the final name is the content hash
         file_ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = f"uploads/{unique_filename}"
+        tmp_path = f"uploads/{uuid.uuid4()}.part"
+        digest = hashlib.sha256(header)
         
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
+        try:
+            # Stream the body to disk in 1 MiB chunks so the event loop stays free
+            async with aiofiles.open(tmp_path, "wb") as buffer:
+                await buffer.write(header)
+                written = len(header)
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        # The declared size can be missing or wrong; enforce the cap on what we actually receive
+                        break
+                    digest.update(chunk)
+                    await buffer.write(chunk)
+
+            if written > max_bytes:
+                raise HTTPException(status_code=413, detail="File is too large")
+
+            # Identical uploads share one file (and therefore one poster cache entry)
+            unique_filename = f"{digest.hexdigest()}{file_ext}"
+            file_path = f"uploads/{unique_filename}"
+            if not await aiofiles.os.path.exists(file_path):
+                await aiofiles.os.replace(tmp_path, file_path)
+        finally:
+            # Whatever went wrong (size cap, disconnect, write error) or if the file was a duplicate,
+            # never leave a partial upload under the publicly served uploads/
+            if await aiofiles.os.path.exists(tmp_path):
+                await aiofiles.os.remove(tmp_path)
+
         # Return the URL to access the file
-        # Assuming server runs on localhost:8000
-        url = f"http://127.0.0.1:8000/uploads/{unique_filename}"
+        url = f"{UPLOADS_BASE_URL}/{unique_filename}"
         
         return UploadResponse(url=url, filename=file.filename)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
 
@@ -111,147 +200,108 @@ async def search_papers(query: str = Query(..., min_length=1), max_results: int
     Search for papers on arXiv.
     """
     try:
-        papers = ArxivFetcher.search_papers(query, max_results=max_results, days_back=days_back)
+        papers = await ArxivFetcher.search_papers(query, max_results=max_results, days_back=days_back)
         return papers
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/analyze-stream")
-async def analyze_paper_stream(pdf_url: str = Query(..., min_length=1)):
+async def analyze_paper_stream(pdf_url: str = Query(..., min_length=1), gemini_agent: GeminiAgent = Depends(get_gemini_agent)):
     """
     Analyze a paper PDF and generate a poster with Server-Sent Events (SSE) for progress updates.
     """
-    if not gemini_agent:
-        raise HTTPException(status_code=503, detail="Gemini Agent not initialized")
-    
     async def event_generator():
         try:
-            # Helper to send progress updates
-            def progress_callback(status_message):
-                # We can't await in a synchronous callback, but we can assume this generator is iterated
-                # For simplicity in this synchronous-wrapped-in-async architecture:
-                pass
-            
-            # Since GeminiAgent is synchronous, we'll manually yield updates before/after blocking calls
-            # Ideally, we would refactor GeminiAgent to be async, but for now we simulate steps
-            
-            yield f"data: {json.dumps({'type': 'progress', 'message': 'Downloading PDF from arXiv...'})}\n\n"
-            await asyncio.sleep(0.1) 
-            
-            # We run the heavy lifting in a thread pool to not block the event loop
-            # However, to stream *real* progress from inside the agent, we need a queue or callback
-            # For this MVP, we will run it in chunks or just notify major steps if we can't easily hook in
-            
-            # Better approach for MVP: Use a simple queue or just yield statuses
-            # Because run_in_executor won't let us yield from within the function easily without complex setup
-            
-            # Let's try to run it directly but with manual yields if possible? 
-            # No, that blocks.
-            # We will use a queue-based callback wrapper
-            
-            from queue import Queue
-            q = Queue()
-            
+            yield {'type': 'progress', 'message': 'Downloading PDF from arXiv...'}
+
+            progress = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+
             def callback(msg):
-                q.put(msg)
-                
-            # Run in separate thread
-            import threading
-            result_container = {}
-            
+                # Invoked from the worker thread; hand the message over to the event loop
+                loop.call_soon_threadsafe(progress.put_nowait, msg)
+
             def worker():
-                try:
-                    # New Pipeline: Prompt -> Image
-                    prompt = gemini_agent.generate_poster_prompt(pdf_url, progress_callback=callback)
-                    
-                    callback("Generating Poster Image (this may take a moment)...")
-                    image_filename = gemini_agent.generate_poster_image(prompt)
-                    
-                    # Assuming server runs on localhost:8000 - ideally use request.base_url but inside thread hard to access
-                    image_url = f"http://127.0.0.1:8000/uploads/{image_filename}"
-                    
-                    result_container['data'] = {'image_url': image_url, 'summary_json': {}}
-                except Exception as e:
-                    result_container['error'] = str(e)
-                finally:
-                    q.put("DONE")
-
-            t = threading.Thread(target=worker)
-            t.start()
-            
-            while True:
-                # Check for messages
-                while not q.empty():
-                    msg = q.get()
-                    if msg == "DONE":
-                        break
-                    yield f"data: {json.dumps({'type': 'progress', 'message': msg})}\n\n"
-                    await asyncio.sleep(0.1) # Yield control
-                
-                if not t.is_alive():
-                    break
-                
-                await asyncio.sleep(0.5)
-            
-            if 'error' in result_container:
-                 yield f"data: {json.dumps({'type': 'error', 'message': result_container['error']})}\n\n"
+                # New Pipeline: Prompt -> Image
+                prompt = gemini_agent.generate_poster_prompt(pdf_url, progress_callback=callback)
+
+                callback("Generating Poster Image (this may take a moment)...")
+                image_filename = gemini_agent.generate_poster_image(prompt)
+
+                image_url = f"{UPLOADS_BASE_URL}/{image_filename}"
+
+                return {'image_url': image_url, 'summary_json': {}}
+
+            # Run in the loop's default executor; the done-callback wakes the consumer below
+            task = asyncio.ensure_future(asyncio.to_thread(worker))
+            task.add_done_callback(lambda _: progress.put_nowait(_STREAM_DONE))
+
+            while (msg := await progress.get()) is not _STREAM_DONE:
+                yield {'type': 'progress', 'message': msg}
+
+            if task.exception() is not None:
+                 yield {'type': 'error', 'message': str(task.exception())}
             else:
-                 yield f"data: {json.dumps({'type': 'complete', 'result': result_container['data']})}\n\n"
+                 yield {'type': 'complete', 'result': task.result()}
 
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield {'type': 'error', 'message': str(e)}
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return sse_response(event_generator())
 
 @app.post("/api/analyze", response_model=PosterResponse)
-async def analyze_paper(request: AnalyzeRequest):
+async def analyze_paper(
+    request: AnalyzeRequest,
+    gemini_agent: GeminiAgent = Depends(get_gemini_agent),
+    cache_manager: CacheManager = Depends(get_cache_manager),
+):
     """
     Analyze a paper PDF and generate a poster.
     """
-    if not gemini_agent:
-        raise HTTPException(status_code=503, detail="Gemini Agent not initialized")
-    
     try:
         # Check cache
-        if cache_manager:
-            cached_result = cache_manager.get_poster(request.pdf_url)
-            if cached_result and 'image_url' in cached_result:
-                print(f"Cache hit for poster: {request.pdf_url}")
-                return PosterResponse(**cached_result)
+        cached_result = await asyncio.to_thread(cache_manager.get_poster, request.pdf_url)
+        if cached_result and 'image_url' in cached_result:
+            print(f"Cache hit for poster: {request.pdf_url}")
+            return PosterResponse(**cached_result)
 
+        # Both steps block on network I/O; run them in the default executor
         # 1. Generate Prompt
-        prompt = gemini_agent.generate_poster_prompt(request.pdf_url)
+        prompt = await asyncio.to_thread(gemini_agent.generate_poster_prompt, request.pdf_url)
         
         # 2. Generate Image
-        image_filename = gemini_agent.generate_poster_image(prompt)
-        image_url = f"http://127.0.0.1:8000/uploads/{image_filename}"
+        image_filename = await asyncio.to_thread(gemini_agent.generate_poster_image, prompt)
+        image_url = f"{UPLOADS_BASE_URL}/{image_filename}"
         
         response_data = {"image_url": image_url, "summary_json": {}}
         
         # Save cache
-        if cache_manager:
-            cache_manager.save_poster(request.pdf_url, response_data)
+        await asyncio.to_thread(cache_manager.save_poster, request.pdf_url, response_data)
 
         return PosterResponse(**response_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/analyze-library")
-async def analyze_library(request: LibraryAnalyzeRequest):
+async def analyze_library(
+    request: LibraryAnalyzeRequest,
+    gemini_agent: GeminiAgent = Depends(get_gemini_agent),
+    cache_manager: CacheManager = Depends(get_cache_manager),
+    user_profile_manager: UserProfileManager = Depends(get_user_profile_manager),
+):
     """
     Analyze multiple papers from the library to extract research directions and suggested queries.
     """
-    if not gemini_agent:
-        raise HTTPException(status_code=503, detail="Gemini Agent not initialized")
-    
     try:
         # Convert URLs to local file paths
+        # Assumes url format: http://.../uploads/filename.pdf
+        candidate_paths = [os.path.join("uploads", url.rsplit("/", 1)[-1]) for url in request.pdf_urls]
+        # Stat all candidates concurrently off the event loop
+        exists = await asyncio.gather(*(aiofiles.os.path.exists(p) for p in candidate_paths))
+
         file_paths = []
-        for url in request.pdf_urls:
-            # Assumes url format: http://.../uploads/filename.pdf
-            filename = url.split("/")[-1]
-            file_path = os.path.join("uploads", filename)
-            if os.path.exists(file_path):
+        for file_path, found in zip(candidate_paths, exists):
+            if found:
                 file_paths.append(file_path)
             else:
                 print(f"Warning: File not found for analysis: {file_path}")
@@ -260,11 +310,10 @@ async def analyze_library(request: LibraryAnalyzeRequest):
             raise HTTPException(status_code=400, detail="No valid local files found to analyze.")
 
         # Check cache (using file paths list)
-        if cache_manager:
-            cached_result = cache_manager.get_library_analysis(file_paths)
-            if cached_result:
-                print(f"Cache hit for library analysis of {len(file_paths)} files")
-                return cached_result
+        cached_result = await asyncio.to_thread(cache_manager.get_library_analysis, file_paths)
+        if cached_result:
+            print(f"Cache hit for library analysis of {len(file_paths)} files")
+            return cached_result
 
         # Call Gemini Agent
         # Note: This is a synchronous call that might take time. 
@@ -272,15 +321,13 @@ async def analyze_library(request: LibraryAnalyzeRequest):
         result = await asyncio.to_thread(gemini_agent.analyze_library, file_paths)
         
         # Save cache
-        if cache_manager:
-            cache_manager.save_library_analysis(file_paths, result)
+        await asyncio.to_thread(cache_manager.save_library_analysis, file_paths, result)
 
         # Save to User Profile for Scheduler
-        if user_profile_manager:
-            user_profile_manager.save_profile(
-                suggested_queries=result.get("suggested_queries", []),
-                research_directions=result.get("research_directions", [])
-            )
+        user_profile_manager.save_profile(
+            suggested_queries=result.get("suggested_queries", []),
+            research_directions=result.get("research_directions", [])
+        )
 
         return result
     except HTTPException:
@@ -289,27 +336,41 @@ async def analyze_library(request: LibraryAnalyzeRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+DIGEST_PATH = "data/latest_digest.json"
+
+# (mtime_ns, parsed) of the last digest read; served from memory while the file is unchanged
+_digest_cache = (None, None)
+
 @app.get("/api/daily-digest")
 async def get_daily_digest():
     """
     Returns the latest daily digest metadata.
     """
+    global _digest_cache
     try:
-        digest_path = "data/latest_digest.json"
-        if os.path.exists(digest_path):
-            with open(digest_path, "r") as f:
-                return json.load(f)
-        return None
+        try:
+            stat = await aiofiles.os.stat(DIGEST_PATH)
+        except FileNotFoundError:
+            return None
+
+        if stat.st_mtime_ns == _digest_cache[0]:
+            return _digest_cache[1]
+
+        async with aiofiles.open(DIGEST_PATH, "rb") as f:
+            data = orjson.loads(await f.read())
+        _digest_cache = (stat.st_mtime_ns, data)
+        return data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/trigger-digest")
-async def trigger_digest():
+async def trigger_digest(force: bool = False):
     """
     Manually triggers the daily digest generation (for testing).
+    Skipped if today's digest already exists, unless `force` is set.
     """
     if scheduler_service:
-        scheduler_service.trigger_now()
+        scheduler_service.trigger_now(force=force)
         return {"message": "Daily Digest generation triggered."}
     raise HTTPException(status_code=503, detail="Scheduler service not initialized")
 
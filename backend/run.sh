@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# Production launcher: uvloop event loop + httptools HTTP parser.
+#
+# The daily-digest scheduler runs inside the app process, so every extra
+# worker starts its own scheduler. Keep WORKERS=1 unless the scheduler is
+# moved out of process.
+set -euo pipefail
+cd "$(dirname "$0")"
+
+exec uvicorn main:app \
+    --host "${HOST:-0.0.0.0}" \
+    --port "${PORT:-8000}" \
+    --loop uvloop \
+    --http httptools \
+    --workers "${WORKERS:-1}" \
+    --limit-concurrency "${LIMIT_CONCURRENCY:-1000}" \
+    --timeout-keep-alive "${TIMEOUT_KEEP_ALIVE:-30}"
@@ -0,0 +1,47 @@
+import hashlib
+import os
+import time
+import orjson
+from typing import Awaitable, Callable, List
+from services.arxiv_fetcher import Paper
+
+# arXiv publishes new listings once a day, so a day-old result is as fresh as a new fetch
+ARXIV_CACHE_TTL = 86400
+
+ARXIV_CACHE_DIR = "data/arxiv_cache"
+
+def cache_key(query: str, max_results: int, days_back: int) -> str:
+    # Collapse whitespace so cosmetic differences in the enhanced query share an entry
+    normalized = " ".join(query.split())
+    return hashlib.sha1(f"{normalized}\x00{max_results}\x00{days_back}".encode("utf-8")).hexdigest()
+
+async def get_or_fetch(key: str, loader: Callable[[], Awaitable[List[Paper]]], ttl: int = ARXIV_CACHE_TTL) -> List[Paper]:
+    """
+    Returns the papers stored under `key` if they were fetched less than `ttl` seconds ago,
+    otherwise awaits `loader()` and stores its result. Expired entries are deleted when read.
+    Empty results aren't stored, since search_papers also returns [] when the request fails.
+    """
+    path = os.path.join(ARXIV_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, "rb") as f:
+            entry = orjson.loads(f.read())
+        if time.time() - entry["fetched_at"] < ttl:
+            return [Paper.model_validate(p) for p in entry["papers"]]
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error reading arXiv cache: {e}")
+
+    papers = await loader()
+    if papers:
+        try:
+            os.makedirs(ARXIV_CACHE_DIR, exist_ok=True)
+            data = orjson.dumps({"fetched_at": time.time(), "papers": [p.model_dump(mode="json") for p in papers]})
+            # Write to a temp file and rename so a concurrent reader never sees a partial entry
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            print(f"Error saving arXiv cache: {e}")
+    return papers
@@ -1,8 +1,16 @@
-import arxiv
+import asyncio
+import threading
+import httpx
+import xml.etree.ElementTree as ET
 from pydantic import BaseModel, Field
-from datetime import datetime, timedelta
-from typing import List, Optional
-from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from cachetools import TTLCache
+from config import settings
+
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+SEARCH_CACHE_TTL = 900  # 15 minutes
 
 class Paper(BaseModel):
     """
@@ -14,74 +22,146 @@ class Paper(BaseModel):
     published_date: datetime
     abstract: str
     pdf_url: str
+    categories: List[str] = Field(default_factory=list) # arXiv category terms, e.g. "cs.CL"
     summary: Optional[dict] = None # To be filled by Gemini later
 
 class ArxivFetcher:
     """
     Service to interact with arXiv API.
     """
-    
+
+    # Shared across requests on the app's event loop so connections are pooled
+    _client: Optional[httpx.AsyncClient] = None
+
+    # Recent results keyed by (query, max_results, days_back). Read from both the
+    # event loop and the scheduler thread, hence the lock.
+    _cache: TTLCache = TTLCache(maxsize=100, ttl=SEARCH_CACHE_TTL)
+    _cache_lock = threading.Lock()
+
+    # Fetches in progress, so concurrent identical searches share one upstream request
+    _inflight: Dict[tuple, asyncio.Task] = {}
+
+    @staticmethod
+    def new_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, read=30.0),
+            follow_redirects=True,
+            mounts={pattern: httpx.AsyncHTTPTransport(proxy=url) for pattern, url in settings().proxy_map().items()}
+        )
+
+    @staticmethod
+    def _get_client() -> httpx.AsyncClient:
+        if ArxivFetcher._client is None or ArxivFetcher._client.is_closed:
+            ArxivFetcher._client = ArxivFetcher.new_client()
+        return ArxivFetcher._client
+
     @staticmethod
-    @lru_cache(maxsize=100) # Cache last 100 search results
-    def search_papers(query: str, max_results: int = 5, days_back: int = 1) -> List[Paper]:
+    async def aclose():
+        if ArxivFetcher._client is not None:
+            await ArxivFetcher._client.aclose()
+            ArxivFetcher._client = None
+
+    @staticmethod
+    def _parse_feed(xml_text: str) -> List[Paper]:
         """
-        Searches for papers on arXiv based on a query.
+        Parses an arXiv Atom feed into Paper objects, preserving feed order.
         """
-        try:
-            # Constructing a client
-            client = arxiv.Client()
-
-            # Search configuration
-            # If days_back is 0 (Any time), sort by Relevance to get the best matches.
-            # If days_back > 0 (Specific range), sort by SubmittedDate to get the latest within that range.
-            sort_criterion = arxiv.SortCriterion.Relevance if days_back == 0 else arxiv.SortCriterion.SubmittedDate
-            
-            # Increase fetch limit for "Any time" searches to find seminal papers that might be buried
-            fetch_limit = max_results * 5 if days_back == 0 else max_results * 2
-
-            print(f"Searching arXiv: query='{query}', days_back={days_back}, sort={sort_criterion}, limit={fetch_limit}")
-
-            search = arxiv.Search(
-                query=query,
-                max_results=fetch_limit, 
-                sort_by=sort_criterion,
-                sort_order=arxiv.SortOrder.Descending
-            )
-
-            results = []
-            
-            # Execute search
-            # Fix: Handle timezone awareness correctly by using UTC or the timezone from the first result if available
-            from datetime import timezone
-            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_back) if days_back > 0 else None
-
-            for result in client.results(search):
-                # Filter by date if days_back is set (>0)
-                if cutoff_date and result.published < cutoff_date:
-                     continue
-
-                # Basic data extraction
-                paper = Paper(
-                    id=result.entry_id,
-                    title=result.title,
-                    authors=[author.name for author in result.authors],
-                    published_date=result.published,
-                    abstract=result.summary.replace("\n", " "),
-                    pdf_url=result.pdf_url
-                )
-                results.append(paper)
-                
-                if len(results) >= max_results:
+        papers = []
+        root = ET.fromstring(xml_text)
+        for entry in root.iter(f"{ATOM_NS}entry"):
+            pdf_url = ""
+            for link in entry.iter(f"{ATOM_NS}link"):
+                if link.get("title") == "pdf":
+                    pdf_url = link.get("href", "")
                     break
-            
-            return results
 
+            published = datetime.strptime(entry.findtext(f"{ATOM_NS}published"), "%Y-%m-%dT%H:%M:%SZ")
+            papers.append(Paper(
+                id=entry.findtext(f"{ATOM_NS}id"),
+                title=" ".join(entry.findtext(f"{ATOM_NS}title", "").split()),
+                authors=[a.findtext(f"{ATOM_NS}name", "") for a in entry.iter(f"{ATOM_NS}author")],
+                published_date=published.replace(tzinfo=timezone.utc),
+                abstract=entry.findtext(f"{ATOM_NS}summary", "").strip().replace("\n", " "),
+                pdf_url=pdf_url,
+                categories=[c.get("term", "") for c in entry.iter(f"{ATOM_NS}category")]
+            ))
+        return papers
+
+    @staticmethod
+    async def search_papers(query: str, max_results: int = 5, days_back: int = 1, client: Optional[httpx.AsyncClient] = None) -> List[Paper]:
+        """
+        Searches for papers on arXiv based on a query.
+        Results are cached for SEARCH_CACHE_TTL seconds and concurrent identical searches are collapsed into one fetch.
+        Callers running outside the app's event loop (e.g. the scheduler thread) must pass their own client.
+        """
+        key = (query, max_results, days_back)
+        with ArxivFetcher._cache_lock:
+            cached = ArxivFetcher._cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        loop = asyncio.get_running_loop()
+        task = ArxivFetcher._inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(ArxivFetcher._fetch(query, max_results, days_back, client))
+            ArxivFetcher._inflight[key] = task
+            task.add_done_callback(lambda t: ArxivFetcher._on_fetched(key, t))
+
+        try:
+            # Shield so a disconnecting caller doesn't cancel the fetch for everyone else
+            return list(await asyncio.shield(task))
         except Exception as e:
             print(f"Error fetching data from arXiv: {e}")
             return []
 
+    @staticmethod
+    def _on_fetched(key: tuple, task: asyncio.Task):
+        if ArxivFetcher._inflight.get(key) is task:
+            del ArxivFetcher._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            with ArxivFetcher._cache_lock:
+                ArxivFetcher._cache[key] = task.result()
+
+    @staticmethod
+    async def _fetch(query: str, max_results: int, days_back: int, client: Optional[httpx.AsyncClient]) -> Tuple[Paper, ...]:
+        # Search configuration
+        # If days_back is 0 (Any time), sort by Relevance to get the best matches.
+        # If days_back > 0 (Specific range), sort by SubmittedDate to get the latest within that range.
+        sort_criterion = "relevance" if days_back == 0 else "submittedDate"
+
+        # Increase fetch limit for "Any time" searches to find seminal papers that might be buried
+        fetch_limit = max_results * 5 if days_back == 0 else max_results * 2
+
+        print(f"Searching arXiv: query='{query}', days_back={days_back}, sort={sort_criterion}, limit={fetch_limit}")
+
+        params = {
+            "search_query": query,
+            "start": 0,
+            "max_results": fetch_limit,
+            "sortBy": sort_criterion,
+            "sortOrder": "descending",
+        }
+        response = await (client or ArxivFetcher._get_client()).get(ARXIV_API_URL, params=params)
+        response.raise_for_status()
+
+        results = []
+        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_back) if days_back > 0 else None
+
+        for paper in ArxivFetcher._parse_feed(response.text):
+            # Filter by date if days_back is set (>0)
+            if cutoff_date and paper.published_date < cutoff_date:
+                 continue
+
+            results.append(paper)
+
+            if len(results) >= max_results:
+                break
+
+        # Tuples so cached entries can't be mutated by callers
+        return tuple(results)
+
 if __name__ == "__main__":
     # Simple test
-    papers = ArxivFetcher.search_papers("Generative AI")
+    papers = asyncio.run(ArxivFetcher.search_papers("Generative AI"))
     for p in papers:
         print(f"[{p.published_date}] {p.title}")
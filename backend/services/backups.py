@@ -0,0 +1,30 @@
+import os
+import shutil
+from datetime import datetime
+
+BACKUP_DIR = "data/backups"
+
+# Copies kept per file; older ones are deleted as new ones are made
+BACKUP_KEEP = 5
+
+def backup_file(path: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+    """
+    Copies `path` to `backup_dir` as <stem>.<timestamp><ext> before it gets replaced,
+    keeping only the `keep` most recent copies. Does nothing if `path` doesn't exist yet.
+    Failures are logged rather than raised, so a backup problem never blocks the write itself.
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        os.makedirs(backup_dir, exist_ok=True)
+        stem, ext = os.path.splitext(os.path.basename(path))
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        shutil.copy2(path, os.path.join(backup_dir, f"{stem}.{stamp}{ext}"))
+
+        # Timestamps sort lexically, so the oldest copies come first
+        prefix = f"{stem}."
+        copies = sorted(n for n in os.listdir(backup_dir) if n.startswith(prefix) and n.endswith(ext))
+        for name in copies[:-keep]:
+            os.remove(os.path.join(backup_dir, name))
+    except Exception as e:
+        print(f"Error backing up {path}: {e}")
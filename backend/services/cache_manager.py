@@ -1,74 +1,78 @@
-import os
-import json
-import hashlib
+import sqlite3
+import threading
+import xxhash
+import orjson
 from typing import List, Optional, Dict, Any
 from pathlib import Path
 
 class CacheManager:
+    """
+    Key-value cache for posters and library analyses, stored in a single SQLite database.
+    Methods are synchronous and may wait on the connection lock; async callers run them via asyncio.to_thread.
+    """
+    TABLES = ("posters", "library")
+
     def __init__(self, cache_dir: str = "data/cache"):
         self.cache_dir = Path(cache_dir)
-        self.posters_dir = self.cache_dir / "posters"
-        self.library_dir = self.cache_dir / "library"
-        
-        # Create directories
-        self.posters_dir.mkdir(parents=True, exist_ok=True)
-        self.library_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "cache.db"
+
+        # Autocommit mode; each write is its own (atomic) transaction
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for table in self.TABLES:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (k TEXT PRIMARY KEY, v BLOB NOT NULL)")
 
     def _get_hash(self, key: str) -> str:
-        return hashlib.md5(key.encode('utf-8')).hexdigest()
+        return xxhash.xxh3_64_hexdigest(key)
 
     def _get_list_hash(self, items: List[str]) -> str:
-        # Sort to ensure order doesn't matter
-        sorted_items = sorted(items)
-        joined = "|".join(sorted_items)
-        return self._get_hash(joined)
+        # Sort to ensure order doesn't matter; feed items straight into the hasher
+        # instead of joining them. NUL can't appear in a path, so it's an unambiguous separator.
+        hasher = xxhash.xxh3_64()
+        for item in sorted(items):
+            hasher.update(item.encode("utf-8"))
+            hasher.update(b"\x00")
+        return hasher.hexdigest()
+
+    def _get(self, table: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT v FROM {table} WHERE k = ?", (key,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def _put(self, table: str, key: str, data: Dict[str, Any]):
+        value = orjson.dumps(data)
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO {table} (k, v) VALUES (?, ?)", (key, value))
 
     # --- Poster Cache ---
-    
+
     def get_poster(self, pdf_url: str) -> Optional[Dict[str, Any]]:
-        key = self._get_hash(pdf_url)
-        file_path = self.posters_dir / f"{key}.json"
-        
-        if file_path.exists():
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error reading poster cache: {e}")
-                return None
-        return None
+        try:
+            return self._get("posters", self._get_hash(pdf_url))
+        except Exception as e:
+            print(f"Error reading poster cache: {e}")
+            return None
 
     def save_poster(self, pdf_url: str, data: Dict[str, Any]):
-        key = self._get_hash(pdf_url)
-        file_path = self.posters_dir / f"{key}.json"
-        
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self._put("posters", self._get_hash(pdf_url), data)
         except Exception as e:
             print(f"Error saving poster cache: {e}")
 
     # --- Library Analysis Cache ---
 
     def get_library_analysis(self, file_paths: List[str]) -> Optional[Dict[str, Any]]:
-        key = self._get_list_hash(file_paths)
-        file_path = self.library_dir / f"{key}.json"
-        
-        if file_path.exists():
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error reading library cache: {e}")
-                return None
-        return None
+        try:
+            return self._get("library", self._get_list_hash(file_paths))
+        except Exception as e:
+            print(f"Error reading library cache: {e}")
+            return None
 
     def save_library_analysis(self, file_paths: List[str], data: Dict[str, Any]):
-        key = self._get_list_hash(file_paths)
-        file_path = self.library_dir / f"{key}.json"
-        
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self._put("library", self._get_list_hash(file_paths), data)
         except Exception as e:
             print(f"Error saving library cache: {e}")
@@ -1,86 +1,371 @@
-import json
+import io
+import logging
+import orjson
 import os
-import requests
-import tempfile
+import hashlib
+import threading
+import httpx
 import time
 import pathlib
-import uuid
+import tempfile
 from google import genai
-from google.genai import types
-from jinja2 import Template, Environment, FileSystemLoader
-from typing import Dict, Any, Optional
-from config import Config
+from google.genai import errors, types
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential, wait_random_exponential
+from jinja2 import Environment, FileSystemLoader
+from pydantic import BaseModel, Field
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+from services.llm_cache import LLMCache
+
+logger = logging.getLogger(__name__)
+
+# Large enough that the copy loop isn't dominated by per-chunk Python overhead and write() syscalls
+PDF_CHUNK_SIZE = 128 * 1024
+
+# arXiv answers 403 to unknown clients, so PDF downloads present a browser-like User-Agent
+PDF_DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# PDFs announced as larger than this are downloaded to a temporary file instead of memory
+PDF_SPOOL_SIZE = 16 * 1024 * 1024
+
+# Keep-alive pool for PDF downloads; a digest fetches a handful of papers from the same host
+PDF_POOL_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=4)
+
+# Connection attempts retried by the download transport before a download fails
+PDF_CONNECT_RETRIES = 3
+
+def _download_transport(proxy: Optional[str] = None) -> httpx.HTTPTransport:
+    return httpx.HTTPTransport(http2=True, limits=PDF_POOL_LIMITS, retries=PDF_CONNECT_RETRIES, proxy=proxy)
+
+# Library PDFs uploaded and processed in parallel by analyze_library
+LIBRARY_UPLOAD_WORKERS = 8
+
+# Where remote Gemini file names are remembered by PDF content hash, so a paper is uploaded once
+GEMINI_FILES_PATH = "data/gemini_files.json"
+
+# The Files API deletes uploads after 48 hours; stop reusing them an hour before that
+GEMINI_FILE_TTL = 47 * 3600
+
+# Gemini failures worth retrying: rate limiting, server-side hiccups and dropped connections
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+_retry_transient = retry(
+    stop=stop_after_attempt(4),
+    wait=wait_random_exponential(multiplier=1, max=20),
+    retry=retry_if_exception(_is_transient),
+    reraise=True
+)
+
+# For calls made with a per-attempt timeout (the scheduled digest): two retries, 1 s then 4 s apart,
+# so the worst case stays at 3 timeouts plus 5 s
+_retry_bounded = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, exp_base=4, max=4),
+    retry=retry_if_exception(_is_transient),
+    reraise=True
+)
+
+def _http_timeout(timeout: Optional[float]) -> Optional[types.HttpOptions]:
+    # The SDK takes the timeout in milliseconds; a timed-out attempt surfaces as a (retryable) httpx error
+    return types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None
+
+class Innovation(BaseModel):
+    emoji: str = Field(description="A single emoji illustrating the innovation")
+    title: str = Field(description="Short innovation title")
+    description: str = Field(description="Short explanation")
+
+class DesignTheme(BaseModel):
+    accent_color: str = Field(description="#HexColorCode; choose a color that fits the topic")
+    highlight_bg: str = Field(description="#HexColorCode; a very light version of the accent color")
+
+class PaperSummary(BaseModel):
+    """
+    Structured-output schema for paper summaries; the field descriptions double as instructions to the model.
+    """
+    title: str = Field(description="A simplified, punchy title (max 10 words)")
+    one_sentence_summary: str = Field(description="A single, powerful sentence capturing the core contribution")
+    key_innovations: List[Innovation] = Field(description="The three key innovations")
+    impact_statement: str = Field(description="Why this research matters for the field (1-2 sentences)")
+    tags: List[str] = Field(description="Three topic tags")
+    design_theme: DesignTheme
+
+class PaperSummaryBatch(BaseModel):
+    summaries: List[PaperSummary]
+
+class LibraryAnalysis(BaseModel):
+    research_directions: List[str] = Field(description="Core research directions, each as 'Direction: brief description'")
+    suggested_queries: List[str] = Field(description="About five arXiv search queries likely to find new, relevant papers")
+
+# Shared fields of the summary returned when summarization fails; handlers fill in the rest.
+# Callers treat summaries as read-only, so the nested values can be shared between errors.
+_ERROR_TEMPLATE = {
+    "key_innovations": [],
+    "tags": ["Error"],
+    "design_theme": {"accent_color": "#ff0000", "highlight_bg": "#ffe6e6"}
+}
+
+# Fixed instructions, built once at import rather than on every call
+_LIBRARY_PROMPT = """
+You are a research mentor. I have provided you with a set of academic papers that represent my current research interests.
+
+Your task is to:
+1. Read these papers to understand the specific problems, methods, and domains I am interested in.
+2. Synthesize my core "Research Directions". These should be descriptive summaries of the fields (e.g., "Efficient Fine-tuning of LLMs", "Multimodal RAG Systems").
+3. Generate a list of "Suggested Search Queries" for arXiv. These should be keywords or short phrases likely to find *new* and *relevant* papers in these areas.
+
+"""
+
+# Role and audience for every summary request, sent as the system instruction. The output
+# layout itself is enforced through response_schema=PaperSummary, whose field descriptions
+# carry the per-field guidance, so it isn't repeated in the prompt.
+_SUMMARY_SYSTEM = """
+You are an expert academic editor and researcher. Extract the key information of the academic paper
+you are given (as a PDF or as its abstract) for busy researchers who need to quickly decide if it is worth reading.
+"""
+
+_BATCH_REQUEST = "Summarize each numbered abstract below, returning one summary per abstract in the same order."
+
+_DIGEST_SYSTEM = """
+你是一名资深学术海报设计师。请根据用户给出的今日 Top 5 论文简要主题，撰写一个高质量图像生成提示词，用于生成“Daily Research Digest”的主海报（Hero）。
+
+设计要求：
+1. 画面比例：16:9 横版，适用于学术报告第一页；分辨率高；避免过小文字。
+2. 风格：高级、克制、现代编辑型（editorial / magazine）信息图；几何构图、网格布局、留白均衡；高对比、可读性强。
+3. 结构：上方主标题“Daily Research Digest”；中部大主题图形；四角或两列板块标示今日议题（例如：多智能体通信解码、LLM导航、图计算模型、量子 ML 等），板块采用清晰标签与图形抽象，不使用密集小字。
+4. 色彩：深靛蓝/海军蓝为主色，辅以蓝绿/青色点缀；统一调性、避免花哨；使用柔和阴影提升层次。
+5. 字体与可读性：标题和板块标签字号明显；不出现难以辨认的小号文字；仅少量必要文字。
+6. 输出：只输出图像生成的提示词正文，不要附加解释或代码。
+"""
+
+_POSTER_PROMPT = "我现在要利用nanobanana画这个文章的主要内容，形成一个学术风格的海报。要求：1. 图像比例为16:9（横屏PPT尺寸）；2. 内容必须高度凝练、信息密度适中，避免大面积空白或无意义的装饰；3. 风格学术、简洁、专业。你帮我根据这个文章内容生成一个绘画prompt。"
 
 class GeminiAgent:
     def __init__(self):
-        # Configure Proxy if set
-        if Config.HTTP_PROXY:
-            os.environ["HTTP_PROXY"] = Config.HTTP_PROXY
-        if Config.HTTPS_PROXY:
-            os.environ["HTTPS_PROXY"] = Config.HTTPS_PROXY
+        # Proxies are passed to each HTTP client rather than exported via os.environ,
+        # so they don't leak into the rest of the process
+        proxies = settings().proxy_map()
 
         # Initialize Client
         # Note: google-genai Client picks up GOOGLE_API_KEY from env automatically if not passed,
-        # but passing it explicitly is safer if Config handles loading.
-        self.client = genai.Client(api_key=Config.GOOGLE_API_KEY)
-        self.model_id = Config.GEMINI_MODEL_NAME
-        self.template_env = Environment(loader=FileSystemLoader("templates"))
+        # but passing it explicitly is safer if Settings handles loading.
+        # The Gemini API is HTTPS-only, so only the HTTPS proxy applies to it.
+        http_options = None
+        if settings().https_proxy:
+            proxy_args = {"proxy": settings().https_proxy}
+            http_options = types.HttpOptions(client_args=proxy_args, async_client_args=proxy_args)
+        self.client = genai.Client(api_key=settings().google_api_key, http_options=http_options)
+        self.model_id = settings().gemini_model_name
+
+        # Pooled HTTP/2 client for PDF downloads, so consecutive papers reuse the TLS session to arXiv
+        self.http = httpx.Client(
+            headers=PDF_DOWNLOAD_HEADERS,
+            timeout=httpx.Timeout(10.0, read=60.0),
+            follow_redirects=True,
+            transport=_download_transport(),
+            mounts={pattern: _download_transport(url) for pattern, url in proxies.items()}
+        )
+        # Templates ship with the app, so skip the per-render mtime check and compile the poster once
+        self.template_env = Environment(loader=FileSystemLoader("templates"), auto_reload=False, cache_size=400)
+        self.poster_template = self.template_env.get_template("poster_template.html")
+
+        # PDF sha256 -> {"name": remote file name, "uploaded_at": epoch seconds}
+        self._gemini_files: Dict[str, Dict[str, Any]] = self._load_gemini_files()
+        self._gemini_files_lock = threading.Lock()
+
+        # Parsed summaries keyed by a hash of the model and input (JSON mode output is effectively
+        # deterministic), persisted so restarts don't pay for the same papers again
+        self._summary_cache = LLMCache()
+
+    def _download_pdf(self, pdf_url: str, dest=None) -> Tuple[Any, str]:
+        """
+        Streams the PDF at `pdf_url` into the writable file object `dest`, hashing it on the way.
+        Without a `dest`, the PDF is buffered in memory unless the server announces more than
+        PDF_SPOOL_SIZE bytes, in which case it goes to an anonymous temporary file.
+        Returns the destination and the SHA-256 of the content.
+        """
+        hasher = hashlib.sha256()
+        try:
+            with self.http.stream("GET", pdf_url) as response:
+                response.raise_for_status()
+                if dest is None:
+                    length = int(response.headers.get("content-length") or 0)
+                    dest = tempfile.TemporaryFile() if length > PDF_SPOOL_SIZE else io.BytesIO()
+                for chunk in response.iter_bytes(PDF_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    dest.write(chunk)
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Download failed: {str(e)}")
+        return dest, hasher.hexdigest()
+
+    @_retry_transient
+    def _upload_file(self, file, config: Optional[types.UploadFileConfig] = None):
+        # Rewind in-memory buffers, which a failed attempt may have partly consumed
+        if hasattr(file, "seek"):
+            file.seek(0)
+        return self.client.files.upload(file=file, config=config)
+
+    @staticmethod
+    def _parse_summary(response) -> Dict[str, Any]:
+        # The SDK validates against PaperSummary already; fall back to the raw text if it couldn't
+        if isinstance(response.parsed, PaperSummary):
+            return response.parsed.model_dump()
+        return orjson.loads(response.text)
+
+    def _await_file_ready(self, upload_file, progress_callback=None, initial: float = 0.25, cap: float = 4.0):
+        """
+        Polls an uploaded file until Gemini has finished processing it.
+        Starts fast since small PDFs are usually ready within a second, then doubles the
+        interval up to `cap` so large files don't burn through files.get quota.
+        """
+        delay = initial
+        if upload_file.state.name == "PROCESSING" and progress_callback:
+            progress_callback("Gemini is processing the file...")
+        while upload_file.state.name == "PROCESSING":
+            time.sleep(delay)
+            delay = min(delay * 2, cap)
+            upload_file = self.client.files.get(name=upload_file.name)
+        return upload_file
+
+    @staticmethod
+    def _load_gemini_files() -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(GEMINI_FILES_PATH, "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error reading Gemini file map: {e}")
+            return {}
+
+    def _save_gemini_files(self):
+        # Caller holds _gemini_files_lock
+        os.makedirs(os.path.dirname(GEMINI_FILES_PATH), exist_ok=True)
+        tmp_path = f"{GEMINI_FILES_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(self._gemini_files))
+        os.replace(tmp_path, GEMINI_FILES_PATH)
+
+    @staticmethod
+    def _file_sha256(path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(PDF_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _get_or_upload_pdf(self, source, digest: str, progress_callback=None):
+        """
+        Returns an ACTIVE Gemini file for the PDF with content hash `digest`, reusing an earlier
+        upload of the same bytes while it is still alive and uploading `source` (a path or an
+        in-memory buffer) otherwise.
+        """
+        with self._gemini_files_lock:
+            entry = self._gemini_files.get(digest)
+        if entry is not None and time.time() - entry["uploaded_at"] < GEMINI_FILE_TTL:
+            try:
+                upload_file = self._await_file_ready(self.client.files.get(name=entry["name"]), progress_callback)
+                if upload_file.state.name == "ACTIVE":
+                    print(f"Reusing Gemini file {upload_file.name}")
+                    return upload_file
+            except Exception as e:
+                print(f"Gemini file {entry['name']} is no longer usable, uploading again: {e}")
+
+        if progress_callback: progress_callback("Uploading PDF to Gemini...")
+        print("Uploading to Gemini File API...")
+        if isinstance(source, str):
+            source = pathlib.Path(source)
+        upload_file = self._upload_file(source, config=types.UploadFileConfig(mime_type="application/pdf"))
+        upload_file = self._await_file_ready(upload_file, progress_callback)
+        if upload_file.state.name == "FAILED":
+            raise ValueError("Gemini failed to process the PDF file.")
+
+        now = time.time()
+        with self._gemini_files_lock:
+            self._gemini_files = {
+                key: value for key, value in self._gemini_files.items()
+                if now - value["uploaded_at"] < GEMINI_FILE_TTL
+            }
+            self._gemini_files[digest] = {"name": upload_file.name, "uploaded_at": now}
+            try:
+                self._save_gemini_files()
+            except Exception as e:
+                print(f"Error saving Gemini file map: {e}")
+        return upload_file
+
+    @_retry_transient
+    def _generate_content(self, **kwargs):
+        return self.client.models.generate_content(**kwargs)
+
+    @_retry_bounded
+    def _generate_content_bounded(self, **kwargs):
+        return self.client.models.generate_content(**kwargs)
+
+    def _generate(self, timeout: Optional[float], **kwargs):
+        # Calls with a deadline also get the tighter retry policy
+        if timeout:
+            return self._generate_content_bounded(**kwargs)
+        return self._generate_content(**kwargs)
+
+    @staticmethod
+    def _cache_key(*parts: str) -> str:
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _get_cached_summary(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self._summary_cache.get(key)
+        except Exception as e:
+            print(f"Error reading summary cache: {e}")
+            return None
+
+    def _set_cached_summary(self, key: str, summary: Dict[str, Any]):
+        try:
+            self._summary_cache.set(key, summary)
+        except Exception as e:
+            print(f"Error saving summary cache: {e}")
+
+    def _upload_and_wait(self, path: str):
+        """
+        Makes a local PDF available in the Gemini File API, reusing a still-live upload of the
+        same bytes (e.g. from an earlier analysis of the same library) when there is one.
+        Returns None if the file is missing; raises if Gemini fails to process it.
+        """
+        if not os.path.exists(path):
+            print(f"Warning: File not found {path}, skipping.")
+            return None
+
+        print(f"Preparing {path} for Gemini...")
+        return self._get_or_upload_pdf(path, self._file_sha256(path))
 
     def analyze_library(self, file_paths: list[str]) -> Dict[str, Any]:
         """
         Analyzes multiple PDF files to extract user research interests and suggested queries.
         """
-        prompt = """
-        You are a research mentor. I have provided you with a set of academic papers that represent my current research interests.
-        
-        Your task is to:
-        1. Read these papers to understand the specific problems, methods, and domains I am interested in.
-        2. Synthesize my core "Research Directions". These should be descriptive summaries of the fields (e.g., "Efficient Fine-tuning of LLMs", "Multimodal RAG Systems").
-        3. Generate a list of "Suggested Search Queries" for arXiv. These should be keywords or short phrases likely to find *new* and *relevant* papers in these areas.
-
-        Output strictly in valid JSON format with the following schema:
-        {
-            "research_directions": [
-                "Direction 1: Brief description",
-                "Direction 2: Brief description"
-            ],
-            "suggested_queries": [
-                "Query 1",
-                "Query 2",
-                "Query 3",
-                "Query 4",
-                "Query 5"
-            ]
-        }
-        """
 
         uploaded_files = []
         
         try:
             print(f"Analyzing library with {len(file_paths)} files...")
             
-            # 1. Upload all files
-            for path in file_paths:
-                if not os.path.exists(path):
-                    print(f"Warning: File not found {path}, skipping.")
-                    continue
-                    
-                print(f"Uploading {path} to Gemini...")
-                try:
-                    upload_file = self.client.files.upload(file=pathlib.Path(path))
-                    
-                    # Wait for processing
-                    while upload_file.state.name == "PROCESSING":
-                        time.sleep(1)
-                        upload_file = self.client.files.get(name=upload_file.name)
-                        
-                    if upload_file.state.name == "FAILED":
-                        print(f"Failed to process {path}")
+            # 1. Upload all files at once so transfers and server-side processing overlap.
+            # Results are collected in input order to keep the prompt (and its output) stable.
+            with ThreadPoolExecutor(max_workers=LIBRARY_UPLOAD_WORKERS) as executor:
+                futures = [(path, executor.submit(self._upload_and_wait, path)) for path in file_paths]
+                for path, future in futures:
+                    try:
+                        upload_file = future.result()
+                    except Exception as e:
+                        print(f"Error uploading {path}: {e}")
                         continue
-                        
-                    uploaded_files.append(upload_file)
-                except Exception as e:
-                    print(f"Error uploading {path}: {e}")
+                    if upload_file is not None:
+                        uploaded_files.append(upload_file)
 
             if not uploaded_files:
                 raise ValueError("No valid files could be processed for analysis.")
@@ -88,18 +373,19 @@ class GeminiAgent:
             # 2. Generate Content
             print("Generating library analysis...")
             
-            # Combine files and prompt
-            contents = uploaded_files + [prompt]
-            
-            response = self.client.models.generate_content(
+            response = self._generate_content(
                 model=self.model_id,
-                contents=contents,
+                contents=uploaded_files,
                 config=types.GenerateContentConfig(
-                    response_mime_type="application/json"
+                    system_instruction=_LIBRARY_PROMPT,
+                    response_mime_type="application/json",
+                    response_schema=LibraryAnalysis
                 )
             )
-            
-            return json.loads(response.text)
+
+            if isinstance(response.parsed, LibraryAnalysis):
+                return response.parsed.model_dump()
+            return orjson.loads(response.text)
 
         except Exception as e:
             print(f"Error in library analysis: {e}")
@@ -108,72 +394,43 @@ class GeminiAgent:
                 "suggested_queries": ["Deep Learning", "Artificial Intelligence"] # Fallbacks
             }
 
-    def summarize_paper(self, pdf_url: str, progress_callback=None) -> Dict[str, Any]:
+    def summarize_paper(self, pdf_url: str, progress_callback=None, abstract: Optional[str] = None) -> Dict[str, Any]:
         """
         Downloads PDF, uploads to Gemini, and summarizes using Multimodal File API.
+        If the arXiv abstract is already known, summarizes that via summarize_text instead,
+        skipping the download, upload and processing wait entirely.
         """
-        prompt = """
-        You are an expert academic editor and researcher. 
-        Your task is to read the attached academic paper (PDF) and extract key information into a structured JSON format.
-        
-        The audience is busy researchers who need to quickly decide if a paper is worth reading.
-        
-        Output strictly in valid JSON format with the following schema:
-        {
-            "title": "A simplified, punchy title (max 10 words)",
-            "one_sentence_summary": "A single, powerful sentence capturing the core contribution.",
-            "key_innovations": [
-                {"emoji": "🚀", "title": "Innovation 1 Title", "description": "Short explanation"},
-                {"emoji": "💡", "title": "Innovation 2 Title", "description": "Short explanation"},
-                {"emoji": "⚙️", "title": "Innovation 3 Title", "description": "Short explanation"}
-            ],
-            "impact_statement": "Why this research matters for the field (1-2 sentences).",
-            "tags": ["Tag1", "Tag2", "Tag3"],
-            "design_theme": {
-                "accent_color": "#HexColorCode (choose a color that fits the topic)",
-                "highlight_bg": "#HexColorCode (a very light version of accent color)"
-            }
-        }
-        """
-        
-        temp_file_path = None
-        
+        if abstract and abstract.strip():
+            if progress_callback: progress_callback("Summarizing abstract...")
+            return self.summarize_text(abstract)
+
+        cache_key = self._cache_key(self.model_id, "pdf", pdf_url)
+        cached = self._get_cached_summary(cache_key)
+        if cached is not None:
+            print(f"Summary cache hit for {pdf_url}")
+            return cached
+
         try:
             # 1. Download PDF
             if progress_callback: progress_callback("Downloading PDF from arXiv...")
             print(f"Downloading PDF from {pdf_url}...")
-            # Use a browser-like User-Agent to avoid 403 Forbidden from arXiv
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            try:
-                # Use a short timeout for connection, longer for read
-                response = requests.get(pdf_url, headers=headers, stream=True, timeout=(10, 60))
-                response.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                raise RuntimeError(f"Download failed: {str(e)}")
-            
-            # Create a temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                temp_file_path = temp_file.name
+            # Buffer the PDF (in memory for typical sizes); it is only needed for the upload below
+            pdf_buffer, pdf_digest = self._download_pdf(pdf_url)
+            pdf_buffer.seek(0)
+
+            # The same PDF may already have been summarized under a different URL
+            content_key = self._cache_key(self.model_id, "pdf-sha256", pdf_digest)
+            cached = self._get_cached_summary(content_key)
+            if cached is not None:
+                print(f"Summary cache hit for content of {pdf_url}")
+                pdf_buffer.close()
+                self._set_cached_summary(cache_key, cached)
+                return cached
             
-            # 2. Upload to Gemini using Client
-            if progress_callback: progress_callback("Uploading PDF to Gemini...")
-            print("Uploading to Gemini File API...")
+            # 2. Upload to Gemini (straight from memory), unless these bytes are already there
             try:
-                # New SDK upload method - use 'file' keyword argument with pathlib.Path object
-                upload_file = self.client.files.upload(file=pathlib.Path(temp_file_path))
-                
-                # Wait for processing
-                while upload_file.state.name == "PROCESSING":
-                    if progress_callback: progress_callback("Gemini is processing the file...")
-                    time.sleep(2)
-                    upload_file = self.client.files.get(name=upload_file.name)
-                    
-                if upload_file.state.name == "FAILED":
-                    raise ValueError("Gemini failed to process the PDF file.")
+                with pdf_buffer:
+                    upload_file = self._get_or_upload_pdf(pdf_buffer, pdf_digest, progress_callback)
             except Exception as e:
                 raise RuntimeError(f"Gemini Upload failed: {str(e)}")
 
@@ -181,108 +438,127 @@ class GeminiAgent:
             if progress_callback: progress_callback("Reading and summarizing paper...")
             print("Generating summary...")
             try:
-                # New SDK generate_content method
-                response = self.client.models.generate_content(
+                request = dict(
                     model=self.model_id,
-                    contents=[upload_file, prompt],
+                    contents=[upload_file],
                     config=types.GenerateContentConfig(
-                        response_mime_type="application/json"
+                        system_instruction=_SUMMARY_SYSTEM,
+                        response_mime_type="application/json",
+                        response_schema=PaperSummary
                     )
                 )
-                if progress_callback: progress_callback("Summary generated. Rendering poster...")
-                return json.loads(response.text)
+                summary = self._parse_summary(self._generate_content(**request))
+                self._set_cached_summary(cache_key, summary)
+                self._set_cached_summary(content_key, summary)
+                return summary
             except Exception as e:
                 raise RuntimeError(f"Gemini Generation failed: {str(e)}")
 
         except Exception as e:
-            print(f"Error in multimodal summarization: {e}")
-            return {
-                "title": "Error Processing Paper",
-                "one_sentence_summary": f"{str(e)}",
-                "key_innovations": [],
-                "impact_statement": "Please check your network connection and proxy settings.",
-                "tags": ["Error"],
-                "design_theme": {"accent_color": "#ff0000", "highlight_bg": "#ffe6e6"}
-            }
-        finally:
-            # Cleanup
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+            return self._paper_error(e)
+
+    @staticmethod
+    def _paper_error(e: Exception) -> Dict[str, Any]:
+        print(f"Error in multimodal summarization: {e}")
+        return {
+            **_ERROR_TEMPLATE,
+            "title": "Error Processing Paper",
+            "one_sentence_summary": str(e),
+            "impact_statement": "Please check your network connection and proxy settings."
+        }
 
-    def summarize_text(self, text: str) -> Dict[str, Any]:
+    def _text_request(self, text: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return dict(
+            model=self.model_id,
+            contents=text,
+            config=types.GenerateContentConfig(
+                system_instruction=_SUMMARY_SYSTEM,
+                response_mime_type="application/json",
+                response_schema=PaperSummary,
+                http_options=_http_timeout(timeout)
+            )
+        )
+
+    @staticmethod
+    def _text_error(e: Exception) -> Dict[str, Any]:
+        logger.warning("Error in summarization: %s", e)
+        # Fallback structure
+        return {
+            **_ERROR_TEMPLATE,
+            "title": "Error Processing Summary",
+            "one_sentence_summary": "Could not generate summary due to API error.",
+            "impact_statement": str(e)
+        }
+
+    def summarize_text(self, text: str, timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Summarizes the text into a structured JSON format.
+        `timeout` works as in generate_poster_image.
         """
-        prompt = """
-        You are an expert academic editor and researcher. 
-        Your task is to read the following academic paper abstract and extract key information into a structured JSON format.
-        
-        The audience is busy researchers who need to quickly decide if a paper is worth reading.
-        
-        Output strictly in valid JSON format with the following schema:
-        {
-            "title": "A simplified, punchy title (max 10 words)",
-            "one_sentence_summary": "A single, powerful sentence capturing the core contribution.",
-            "key_innovations": [
-                {"emoji": "🚀", "title": "Innovation 1 Title", "description": "Short explanation"},
-                {"emoji": "💡", "title": "Innovation 2 Title", "description": "Short explanation"},
-                {"emoji": "⚙️", "title": "Innovation 3 Title", "description": "Short explanation"}
-            ],
-            "impact_statement": "Why this research matters for the field (1-2 sentences).",
-            "tags": ["Tag1", "Tag2", "Tag3"],
-            "design_theme": {
-                "accent_color": "#HexColorCode (choose a color that fits the topic)",
-                "highlight_bg": "#HexColorCode (a very light version of accent color)"
-            }
-        }
 
-        Abstract:
+        cache_key = self._cache_key(self.model_id, "text", text)
+        cached = self._get_cached_summary(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            response = self._generate(timeout, **self._text_request(text, timeout))
+            summary = self._parse_summary(response)
+            self._set_cached_summary(cache_key, summary)
+            return summary
+        except Exception as e:
+            return self._text_error(e)
+
+    def summarize_texts_batch(self, texts: list[str], timeout: Optional[float] = None) -> list[Dict[str, Any]]:
         """
-        
+        Summarizes several abstracts with a single generate_content call, returning summaries in the order of `texts`.
+        Shares summarize_text's cache: cached abstracts are left out of the request and new results are stored per abstract.
+        If the call fails, every abstract that wasn't cached gets an error summary.
+        `timeout` works as in generate_poster_image.
+        """
+        keys = [self._cache_key(self.model_id, "text", text) for text in texts]
+        summaries: List[Optional[Dict[str, Any]]] = [self._get_cached_summary(key) for key in keys]
+        pending = [i for i, summary in enumerate(summaries) if summary is None]
+        if not pending:
+            return summaries
+
+        numbered = "\n\n".join(f"Abstract {n}:\n{texts[i]}" for n, i in enumerate(pending, 1))
         try:
-            # New SDK generate_content method
-            response = self.client.models.generate_content(
+            print(f"Generating batch summary for {len(pending)} abstracts...")
+            response = self._generate(
+                timeout,
                 model=self.model_id,
-                contents=f"{prompt}\n{text}",
+                contents=f"{_BATCH_REQUEST}\n\n{numbered}",
                 config=types.GenerateContentConfig(
-                    response_mime_type="application/json"
+                    system_instruction=_SUMMARY_SYSTEM,
+                    response_mime_type="application/json",
+                    response_schema=PaperSummaryBatch,
+                    http_options=_http_timeout(timeout)
                 )
             )
-            return json.loads(response.text)
+            if isinstance(response.parsed, PaperSummaryBatch):
+                results = [summary.model_dump() for summary in response.parsed.summaries]
+            else:
+                results = orjson.loads(response.text)["summaries"]
+            if len(results) != len(pending):
+                raise ValueError(f"Expected {len(pending)} summaries, got {len(results)}")
+
+            for i, summary in zip(pending, results):
+                self._set_cached_summary(keys[i], summary)
+                summaries[i] = summary
         except Exception as e:
-            print(f"Error in summarization: {e}")
-            # Fallback structure
-            return {
-                "title": "Error Processing Summary",
-                "one_sentence_summary": "Could not generate summary due to API error.",
-                "key_innovations": [],
-                "impact_statement": str(e),
-                "tags": ["Error"],
-                "design_theme": {"accent_color": "#ff0000", "highlight_bg": "#ffe6e6"}
-            }
+            error = self._text_error(e)
+            for i in pending:
+                summaries[i] = error
+
+        return summaries
 
     def generate_poster_html(self, summary_json: Dict[str, Any]) -> str:
         """
         Generates HTML code for the poster using Jinja2 template.
         """
         try:
-            template = self.template_env.get_template("poster_template.html")
-            
-            # Helper to safely get nested values
-            def safe_get(data, keys, default=None):
-                for key in keys:
-                    if isinstance(data, dict):
-                        data = data.get(key, {})
-                    else:
-                        return default
-                return data if data else default
-
-            # Check if summary_json is a list (sometimes Gemini returns a list of one object)
-            if isinstance(summary_json, list):
-                if len(summary_json) > 0:
-                    summary_json = summary_json[0]
-                else:
-                    summary_json = {}
+            theme = summary_json.get("design_theme") or {}
 
             # Map JSON data to template variables
             render_data = {
@@ -291,12 +567,12 @@ class GeminiAgent:
                 "key_innovations": summary_json.get("key_innovations", []),
                 "impact_statement": summary_json.get("impact_statement", ""),
                 "tags": summary_json.get("tags", []),
-                "accent_color": summary_json.get("design_theme", {}).get("accent_color", "#3b82f6"),
-                "highlight_bg": summary_json.get("design_theme", {}).get("highlight_bg", "#eff6ff"),
+                "accent_color": theme.get("accent_color", "#3b82f6"),
+                "highlight_bg": theme.get("highlight_bg", "#eff6ff"),
                 "title": summary_json.get("title", "Paper Poster")
             }
             
-            return template.render(**render_data)
+            return self.poster_template.render(**render_data)
         except Exception as e:
             print(f"Error generating poster HTML: {e}")
             return f"<div>Error generating poster: {str(e)}</div>"
@@ -306,7 +582,6 @@ class GeminiAgent:
         Generates a prompt for the image generator based on the paper content.
         Uses GEMINI_TEXT_MODEL.
         """
-        prompt = "我现在要利用nanobanana画这个文章的主要内容，形成一个学术风格的海报。要求：1. 图像比例为16:9（横屏PPT尺寸）；2. 内容必须高度凝练、信息密度适中，避免大面积空白或无意义的装饰；3. 风格学术、简洁、专业。你帮我根据这个文章内容生成一个绘画prompt。"
         
         pdf_filename = os.path.basename(pdf_url)
         if not pdf_filename.lower().endswith('.pdf'):
@@ -322,21 +597,12 @@ class GeminiAgent:
             # 1. Download PDF (if not exists)
             if os.path.exists(saved_pdf_path) and os.path.getsize(saved_pdf_path) > 0:
                  print(f"PDF already exists at {saved_pdf_path}, skipping download.")
+                 pdf_digest = self._file_sha256(saved_pdf_path)
             else:
                 if progress_callback: progress_callback("Downloading PDF from arXiv...")
                 print(f"Downloading PDF from {pdf_url}...")
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-                }
-                try:
-                    response = requests.get(pdf_url, headers=headers, stream=True, timeout=(10, 60))
-                    response.raise_for_status()
-                except requests.exceptions.RequestException as e:
-                    raise RuntimeError(f"Download failed: {str(e)}")
-                
                 with open(saved_pdf_path, "wb") as pdf_file:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        pdf_file.write(chunk)
+                    _, pdf_digest = self._download_pdf(pdf_url, pdf_file)
             
             # Check file size
             file_size = os.path.getsize(saved_pdf_path)
@@ -344,29 +610,9 @@ class GeminiAgent:
             if file_size == 0:
                 raise ValueError("PDF is empty (0 bytes).")
             
-            # 2. Upload to Gemini
-            if progress_callback: progress_callback("Uploading PDF to Gemini...")
-            print("Uploading to Gemini File API...")
+            # 2. Upload to Gemini, unless summarize_paper (or an earlier poster) already did
             try:
-                # Add retry logic for upload
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        upload_file = self.client.files.upload(file=pathlib.Path(saved_pdf_path))
-                        break
-                    except Exception as e:
-                        if attempt == max_retries - 1:
-                            raise e
-                        print(f"Upload attempt {attempt+1} failed: {e}. Retrying...")
-                        time.sleep(2)
-                
-                while upload_file.state.name == "PROCESSING":
-                    if progress_callback: progress_callback("Gemini is processing the file...")
-                    time.sleep(2)
-                    upload_file = self.client.files.get(name=upload_file.name)
-                
-                if upload_file.state.name == "FAILED":
-                    raise ValueError("Gemini failed to process the PDF file.")
+                upload_file = self._get_or_upload_pdf(saved_pdf_path, pdf_digest, progress_callback)
             except Exception as e:
                 raise RuntimeError(f"Gemini Upload failed: {str(e)}")
 
@@ -374,9 +620,9 @@ class GeminiAgent:
             if progress_callback: progress_callback("Generating Image Prompt...")
             print("Generating prompt...")
             try:
-                response = self.client.models.generate_content(
-                    model=Config.GEMINI_TEXT_MODEL,
-                    contents=[upload_file, prompt]
+                response = self._generate_content(
+                    model=settings().gemini_text_model,
+                    contents=[upload_file, _POSTER_PROMPT]
                 )
                 return response.text
             except Exception as e:
@@ -387,35 +633,40 @@ class GeminiAgent:
             raise e
         # Note: We do NOT delete the file in finally block anymore
 
-    def generate_poster_image(self, prompt: str, output_dir: str = "uploads") -> str:
+    def generate_poster_image(self, prompt: str, output_dir: str = "uploads", timeout: Optional[float] = None) -> str:
         """
         Generates an image based on the prompt and saves it.
         Uses GEMINI_IMAGE_MODEL.
+        `timeout` (seconds) bounds each attempt, with at most two retries (see _retry_bounded).
         Returns the filename.
         """
         try:
             print(f"Generating image with prompt (len={len(prompt)})...")
             
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_IMAGE_MODEL,
+            response = self._generate(
+                timeout,
+                model=settings().gemini_image_model,
                 contents=prompt,
                 config=types.GenerateContentConfig(
-                    response_modalities=['Text', 'Image']
+                    response_modalities=['Text', 'Image'],
+                    http_options=_http_timeout(timeout)
                 )
             )
             
             for part in response.parts:
                 if part.inline_data:
-                    # Found image data
-                    filename = f"{uuid.uuid4()}.png"
+                    # Found image data; name it by content so a repeated image is stored (and cached by URL) once
+                    data = part.inline_data.data
+                    filename = f"{hashlib.blake2b(data, digest_size=12).hexdigest()}.png"
                     filepath = os.path.join(output_dir, filename)
                     
                     # Ensure directory exists
                     os.makedirs(output_dir, exist_ok=True)
                     
                     # Write bytes
-                    with open(filepath, "wb") as f:
-                        f.write(part.inline_data.data)
+                    if not os.path.exists(filepath):
+                        with open(filepath, "wb") as f:
+                            f.write(data)
                         
                     print(f"Image saved to {filepath}")
                     return filename
@@ -432,30 +683,18 @@ class GeminiAgent:
             print(f"Error generating image: {e}")
             raise e
 
-    def generate_daily_digest_prompt(self, papers_summary: str) -> str:
+    def generate_daily_digest_prompt(self, papers_summary: str, timeout: Optional[float] = None) -> str:
         """
         Generates a prompt for the daily digest poster based on summarized papers.
+        `timeout` works as in generate_poster_image.
         """
-        prompt = f"""
-        你是一名资深学术海报设计师。请撰写一个高质量图像生成提示词，用于生成“Daily Research Digest”的主海报（Hero）。
-        
-        输入为今日 Top 5 论文的简要主题：
-        {papers_summary}
-        
-        设计要求：
-        1. 画面比例：16:9 横版，适用于学术报告第一页；分辨率高；避免过小文字。
-        2. 风格：高级、克制、现代编辑型（editorial / magazine）信息图；几何构图、网格布局、留白均衡；高对比、可读性强。
-        3. 结构：上方主标题“Daily Research Digest”；中部大主题图形；四角或两列板块标示今日议题（例如：多智能体通信解码、LLM导航、图计算模型、量子 ML 等），板块采用清晰标签与图形抽象，不使用密集小字。
-        4. 色彩：深靛蓝/海军蓝为主色，辅以蓝绿/青色点缀；统一调性、避免花哨；使用柔和阴影提升层次。
-        5. 字体与可读性：标题和板块标签字号明显；不出现难以辨认的小号文字；仅少量必要文字。
-        6. 输出：只输出图像生成的提示词正文，不要附加解释或代码。
-        """
-        
         try:
             print("Generating Daily Digest Prompt...")
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_TEXT_MODEL,
-                contents=prompt
+            response = self._generate(
+                timeout,
+                model=settings().gemini_text_model,
+                contents=f"今日 Top 5 论文的简要主题：\n{papers_summary}",
+                config=types.GenerateContentConfig(system_instruction=_DIGEST_SYSTEM, http_options=_http_timeout(timeout))
             )
             return response.text
         except Exception as e:
@@ -467,13 +706,10 @@ class GeminiAgent:
         Generates a compact image prompt for a single article card.
         The goal is a small illustrative thumbnail with minimalist academic style.
         """
-        # Ensure dict-like input
-        if isinstance(summary_json, list) and summary_json:
-            summary_json = summary_json[0]
         title = summary_json.get("title", "Research Update")
         one_liner = summary_json.get("one_sentence_summary", "")
         tags = summary_json.get("tags", [])
-        accent = summary_json.get("design_theme", {}).get("accent_color", "#2563eb")
+        accent = (summary_json.get("design_theme") or {}).get("accent_color", "#2563eb")
         prompt = (
             f"高级学术缩略图，简洁克制、信息图风格，主色调{accent}；"
             f"主题：{title}；核心一句话：{one_liner}；"
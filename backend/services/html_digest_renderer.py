@@ -1,7 +1,17 @@
 import json
 import os
+from functools import lru_cache
 from jinja2 import Environment, FileSystemLoader
 
+# Templates ship with the app, so the environment never re-checks them for changes
+_ENV = Environment(loader=FileSystemLoader("templates"), auto_reload=False)
+
+
+@lru_cache(maxsize=1)
+def _digest_template():
+    # Compiled on first render rather than at import, so importing doesn't depend on the cwd
+    return _ENV.get_template("digest_newspaper.html")
+
 
 def render_from_latest(digest_json_path: str, output_html_path: str):
     if not os.path.exists(digest_json_path):
@@ -30,9 +40,7 @@ def render_from_latest(digest_json_path: str, output_html_path: str):
             "image_url": it.get("image_url", hero),
         })
 
-    env = Environment(loader=FileSystemLoader("templates"))
-    tpl = env.get_template("digest_newspaper.html")
-    html = tpl.render(date=date, featured=featured, papers=papers)
+    html = _digest_template().render(date=date, featured=featured, papers=papers)
 
     os.makedirs(os.path.dirname(output_html_path), exist_ok=True)
     with open(output_html_path, "w", encoding="utf-8") as f:
@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+import time
+import orjson
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Entries older than this are treated as misses and pruned
+LLM_CACHE_TTL = 30 * 24 * 3600
+
+# Rows kept on disk; least recently used entries beyond this are evicted
+LLM_CACHE_MAX_ENTRIES = 1000
+
+# Hot entries also kept decoded in memory
+LLM_CACHE_MEMORY_SIZE = 256
+
+class LLMCache:
+    """
+    Persistent cache of parsed Gemini responses, keyed by a hash of the model and input.
+    An in-memory LRU sits in front of a SQLite table so repeated lookups skip both the disk and the decode,
+    and results survive restarts.
+    """
+
+    def __init__(self, cache_dir: str = "data/cache"):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "llm_cache.db"
+
+        # Autocommit mode; each write is its own (atomic) transaction
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(k TEXT PRIMARY KEY, v BLOB NOT NULL, ts INTEGER NOT NULL, used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_used ON llm_cache (used)")
+
+        # key -> (write time, value)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a copy of the cached value, or None if it is missing or expired.
+        """
+        now = int(time.time())
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] < LLM_CACHE_TTL:
+                    self._memory.move_to_end(key)
+                    return dict(entry[1])
+                del self._memory[key]
+
+            row = self._conn.execute("SELECT v, ts FROM llm_cache WHERE k = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] >= LLM_CACHE_TTL:
+                self._conn.execute("DELETE FROM llm_cache WHERE k = ?", (key,))
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET used = ? WHERE k = ?", (now, key))
+            value = orjson.loads(row[0])
+            self._remember(key, row[1], value)
+            return dict(value)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        now = int(time.time())
+        data = orjson.dumps(value)
+        with self._lock:
+            self._remember(key, now, value)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (k, v, ts, used) VALUES (?, ?, ?, ?)",
+                (key, data, now, now)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE ts <= ?", (now - LLM_CACHE_TTL,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE k IN "
+                "(SELECT k FROM llm_cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (LLM_CACHE_MAX_ENTRIES,)
+            )
+
+    def _remember(self, key: str, ts: int, value: Dict[str, Any]):
+        self._memory[key] = (ts, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > LLM_CACHE_MEMORY_SIZE:
+            self._memory.popitem(last=False)
@@ -1,13 +1,53 @@
+import hashlib
+import io
 import os
-import uuid
-from typing import List, Dict, Optional
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, List, Dict, Optional, Tuple
 
-from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+import xxhash
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 
 
+FONT_CANDIDATES = (
+    "C:\\Windows\\Fonts\\segoeui.ttf",
+    "C:\\Windows\\Fonts\\Segoe UI.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+)
+
+
+# Digest canvas geometry
+CANVAS_W, CANVAS_H = 1920, 1080
+HEADER_H = 120
+MARGIN = 40
+HERO_W, HERO_H = 980, 540
+GRID_X = MARGIN + HERO_W + 48  # articles column, right of the hero
+
+# Resized hero/thumbnail images, reused when the same digest is rendered again. Kept outside the
+# publicly served uploads/ tree, next to the other runtime caches
+FITTED_CACHE_DIR = "data/cache/fitted"
+
+# Resized images kept in FITTED_CACHE_DIR; least recently used ones beyond this are deleted
+FITTED_CACHE_MAX = 64
+
+@dataclass(slots=True)
+class ArticleCard:
+    """
+    One article on the digest: what the layout draws and what goes into latest_digest.json.
+    """
+    paper_id: str
+    title: str
+    summary: str
+    authors: str
+    design_theme: Dict[str, Any]
+    image_path: Optional[str] = None
+
 class NewspaperLayout:
     @staticmethod
-    def _load_font(candidates: List[str], size: int):
+    @lru_cache(maxsize=16)
+    def _load_font(candidates: Tuple[str, ...], size: int):
+        # Cached per (candidates, size): opening a TrueType face re-reads the file from disk
         for path in candidates:
             if path and os.path.exists(path):
                 try:
@@ -20,66 +60,149 @@ class NewspaperLayout:
             return ImageFont.load_default()
 
     @staticmethod
-    def _wrap_text(draw: ImageDraw.Draw, text: str, font: ImageFont.ImageFont, max_width: int) -> List[str]:
-        words = text.split()
+    @lru_cache(maxsize=8)
+    def _shadow_sprite(w: int, h: int, alpha: int, blur: int = 6) -> Image.Image:
+        """
+        Soft drop shadow for a w x h box, padded by 2 * blur on every side for the falloff.
+        Geometry is fixed per layout, so each sprite is drawn and blurred once per process.
+        """
+        pad = 2 * blur
+        sprite = Image.new("RGBA", (w + 2 * pad, h + 2 * pad), (0, 0, 0, 0))
+        ImageDraw.Draw(sprite).rectangle([pad, pad, w + pad, h + pad], fill=(0, 0, 0, alpha))
+        return sprite.filter(ImageFilter.GaussianBlur(blur))
+
+    @staticmethod
+    def _load_fitted(src: str, size: Tuple[int, int], cache_dir: str) -> Image.Image:
+        """
+        Loads `src` resized to exactly `size` with LANCZOS, reusing a copy cached on disk
+        from earlier renders of the same (unchanged) image.
+        The copy is lossless, so a cache hit yields the same pixels (and the same digest file) as a miss.
+        """
+        key = xxhash.xxh3_64_hexdigest(f"{src}:{os.path.getmtime(src)}:{size[0]}x{size[1]}")
+        cached = os.path.join(cache_dir, f"{key}.png")
+        if os.path.exists(cached):
+            with Image.open(cached) as im:
+                fitted = im.convert("RGB")
+            try:
+                # Mark as recently used for pruning
+                os.utime(cached)
+            except OSError:
+                pass
+            return fitted
+
+        with Image.open(src) as im:
+            fitted = im.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fitted.save(cached, "PNG", compress_level=1)
+            NewspaperLayout._prune_fitted(cache_dir)
+        except OSError:
+            pass
+        return fitted
+
+    @staticmethod
+    def _prune_fitted(cache_dir: str):
+        # Keep only the most recently used FITTED_CACHE_MAX entries
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file():
+                entries.append((entry.stat().st_mtime, entry.path))
+        if len(entries) <= FITTED_CACHE_MAX:
+            return
+        entries.sort()
+        for _, path in entries[:-FITTED_CACHE_MAX]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _ascii_advances(font: ImageFont.ImageFont) -> Dict[str, float]:
+        # Fonts are cached by _load_font, so each face is measured once per process
+        return {chr(c): font.getlength(chr(c)) for c in range(32, 127)}
+
+    @staticmethod
+    def _wrap_text(text: str, font: ImageFont.ImageFont, max_width: int) -> List[str]:
+        # Measure each word once and pack greedily by summing widths, instead of re-measuring
+        # the whole candidate line for every word
+        advances = NewspaperLayout._ascii_advances(font)
+        space = advances[" "]
         lines = []
-        current = ""
-        for w in words:
-            test = (current + " " + w).strip()
-            if draw.textlength(test, font=font) <= max_width:
-                current = test
+        current: List[str] = []
+        current_w = 0.0
+        for w in text.split():
+            # Plain ASCII words (nearly all of them) are summed from the advance table; anything else
+            # goes to FreeType. Kerning is ignored either way, as the additive packing already assumes.
+            ww = sum(advances[c] for c in w) if w.isascii() and w.isprintable() else font.getlength(w)
+            added = ww + space if current else ww
+            if current_w + added <= max_width:
+                current.append(w)
+                current_w += added
             else:
                 if current:
-                    lines.append(current)
-                current = w
+                    lines.append(" ".join(current))
+                current = [w]
+                current_w = ww
         if current:
-            lines.append(current)
+            lines.append(" ".join(current))
         return lines
 
     @staticmethod
-    def render_digest(title: str, date_text: str, hero_image_path: Optional[str], articles: List[Dict], output_dir: str) -> str:
-        os.makedirs(output_dir, exist_ok=True)
-        W, H = 1920, 1080
+    @lru_cache(maxsize=8)
+    def _scaffold(title: str, date_text: str) -> Image.Image:
+        """
+        The static chrome of a digest (background, header, column separator, footer), which only
+        depends on the title and date. Cached; callers must draw on a copy.
+        """
+        W, H = CANVAS_W, CANVAS_H
         bg = Image.new("RGB", (W, H), (242, 244, 248))  # softer scaffold gray
         draw = ImageDraw.Draw(bg)
-
-        # Fonts
-        font_candidates = [
-            "C:\\Windows\\Fonts\\segoeui.ttf",
-            "C:\\Windows\\Fonts\\Segoe UI.ttf",
-            "C:\\Windows\\Fonts\\arial.ttf",
-        ]
-        title_font = NewspaperLayout._load_font(font_candidates, 68)
-        subtitle_font = NewspaperLayout._load_font(font_candidates, 34)
-        body_font = NewspaperLayout._load_font(font_candidates, 26)
-        small_font = NewspaperLayout._load_font(font_candidates, 20)
+        title_font = NewspaperLayout._load_font(FONT_CANDIDATES, 68)
+        subtitle_font = NewspaperLayout._load_font(FONT_CANDIDATES, 34)
+        small_font = NewspaperLayout._load_font(FONT_CANDIDATES, 20)
 
         # Header bar
-        header_h = 120
-        # gradient header
-        header = Image.new("RGBA", (W, header_h), (0, 0, 0, 0))
-        hd = ImageDraw.Draw(header)
-        for i in range(header_h):
-            # top dark navy to slightly lighter
-            c = (26, 35, 49 + int(i * 0.1), 255)
-            hd.line([(0, i), (W, i)], fill=c)
+        header_h = HEADER_H
+        # gradient header, top dark navy to slightly lighter; built as one array since it is opaque
+        rows = np.arange(header_h, dtype=np.float32)
+        rgb = np.stack([np.full_like(rows, 26), np.full_like(rows, 35), 49 + rows * 0.1], axis=1).astype(np.uint8)
+        header = Image.fromarray(np.broadcast_to(rgb[:, None, :], (header_h, W, 3)).copy(), "RGB")
         bg.paste(header, (0, 0))
         draw.text((48, 26), title, fill=(255, 255, 255), font=title_font)
         draw.text((W - 280, 38), date_text, fill=(220, 225, 232), font=subtitle_font)
 
+        # column separator
+        draw.line([(GRID_X - 24, header_h + 20), (GRID_X - 24, H - 60)], fill=(203, 210, 220), width=2)
+
+        # Footer
+        draw.text((MARGIN, H - 42), "Generated by Daily Scholar", fill=(120, 126, 134), font=small_font)
+        return bg
+
+    @staticmethod
+    def render_digest(title: str, date_text: str, hero_image_path: Optional[str], articles: List[ArticleCard], output_dir: str) -> str:
+        os.makedirs(output_dir, exist_ok=True)
+        thumb_cache_dir = FITTED_CACHE_DIR
+        W = CANVAS_W
+        bg = NewspaperLayout._scaffold(title, date_text).copy()
+        draw = ImageDraw.Draw(bg)
+
+        # Fonts
+        subtitle_font = NewspaperLayout._load_font(FONT_CANDIDATES, 34)
+        body_font = NewspaperLayout._load_font(FONT_CANDIDATES, 26)
+        small_font = NewspaperLayout._load_font(FONT_CANDIDATES, 20)
+        header_h = HEADER_H
+
         # Hero image area
-        margin = 40
+        margin = MARGIN
         hero_x, hero_y = margin, header_h + 24
-        hero_w, hero_h = 980, 540
+        hero_w, hero_h = HERO_W, HERO_H
         if hero_image_path and os.path.exists(hero_image_path):
             try:
-                hero = Image.open(hero_image_path).convert("RGB")
-                hero = hero.resize((hero_w, hero_h))
+                hero = NewspaperLayout._load_fitted(hero_image_path, (hero_w, hero_h), thumb_cache_dir)
                 # subtle shadow
-                shadow = Image.new("RGBA", (hero_w + 20, hero_h + 20), (0, 0, 0, 0))
-                sd = ImageDraw.Draw(shadow)
-                sd.rectangle([10, 10, hero_w + 10, hero_h + 10], fill=(0, 0, 0, 40))
-                bg.paste(shadow, (hero_x - 10, hero_y - 10), shadow)
+                shadow = NewspaperLayout._shadow_sprite(hero_w, hero_h, 40, 10)
+                bg.paste(shadow, (hero_x - 20, hero_y - 20), shadow)
                 bg.paste(hero, (hero_x, hero_y))
             except Exception:
                 draw.rectangle([hero_x, hero_y, hero_x + hero_w, hero_y + hero_h], outline=(31, 41, 55), width=3)
@@ -88,7 +211,7 @@ class NewspaperLayout:
         draw.text((hero_x, hero_y - 40), "Top Theme", fill=(31, 41, 55), font=subtitle_font)
 
         # Articles grid on the right
-        grid_x = hero_x + hero_w + 48
+        grid_x = GRID_X
         grid_y = hero_y
         grid_w = W - grid_x - margin
         card_w = grid_w
@@ -97,25 +220,19 @@ class NewspaperLayout:
         thumb_h = 168
         gap = 18
 
-        # column separator
-        draw.line([(grid_x - 24, header_h + 20), (grid_x - 24, H - 60)], fill=(203, 210, 220), width=2)
-
         for idx, art in enumerate(articles[:5]):
             y = grid_y + idx * (card_h + gap)
             # Card background with shadow
-            shadow = Image.new("RGBA", (card_w + 12, card_h + 12), (0, 0, 0, 0))
-            sd = ImageDraw.Draw(shadow)
-            sd.rectangle([8, 8, card_w + 8, card_h + 8], fill=(0, 0, 0, 28))
-            bg.paste(shadow, (grid_x - 8, y - 8), shadow)
+            shadow = NewspaperLayout._shadow_sprite(card_w, card_h, 28)
+            bg.paste(shadow, (grid_x - 12, y - 12), shadow)
 
             draw.rectangle([grid_x, y, grid_x + card_w, y + card_h], fill=(255, 255, 255), outline=(226, 232, 240))
             # Thumbnail
             tx, ty = grid_x + 12, y + 10
             thumb_box = [tx, ty, tx + thumb_w, ty + thumb_h]
-            if art.get("image_path") and os.path.exists(art["image_path"]):
+            if art.image_path and os.path.exists(art.image_path):
                 try:
-                    th = Image.open(art["image_path"]).convert("RGB")
-                    th = th.resize((thumb_w, thumb_h))
+                    th = NewspaperLayout._load_fitted(art.image_path, (thumb_w, thumb_h), thumb_cache_dir)
                     bg.paste(th, (tx, ty))
                 except Exception:
                     draw.rectangle(thumb_box, outline=(31, 41, 55))
@@ -127,32 +244,36 @@ class NewspaperLayout:
             text_w = card_w - (text_x - grid_x) - 16
 
             # Title
-            title_text = art.get("title", "Untitled")
-            title_lines = NewspaperLayout._wrap_text(draw, title_text, subtitle_font, text_w)
+            title_text = art.title
+            title_lines = NewspaperLayout._wrap_text(title_text, subtitle_font, text_w)
             title_render = title_lines[0] if title_lines else title_text
             if len(title_lines) > 1:
                 title_render = title_render.rstrip() + "…"
             draw.text((text_x, y + 14), title_render, fill=(17, 24, 39), font=subtitle_font)
 
             # Authors
-            authors = art.get("authors", "")
+            authors = art.authors
             draw.text((text_x, y + 62), authors, fill=(88, 96, 105), font=small_font)
 
             # Summary
-            summary = art.get("summary", "")
-            lines = NewspaperLayout._wrap_text(draw, summary, body_font, text_w)
+            summary = art.summary
+            lines = NewspaperLayout._wrap_text(summary, body_font, text_w)
             max_lines = 3
             for i, line in enumerate(lines[:max_lines]):
                 draw.text((text_x, y + 98 + i * 30), line, fill=(39, 49, 65), font=body_font)
             if len(lines) > max_lines:
                 draw.text((text_x, y + 98 + max_lines * 30), "…", fill=(39, 49, 65), font=body_font)
 
-        # Footer
-        draw.text((margin, H - 42), "Generated by Daily Scholar", fill=(120, 126, 134), font=small_font)
-
-        # Save
-        fname = f"{uuid.uuid4()}.png"
+        # Save under a name derived from the bytes, so identical re-renders share one file (and URL)
+        buf = io.BytesIO()
+        # Fast zlib level: the digest is an intermediate served once to the browser, so encode time
+        # matters more than a few hundred KB
+        bg.save(buf, format="PNG", compress_level=1, optimize=False)
+        data = buf.getvalue()
+        fname = f"{hashlib.blake2b(data, digest_size=12).hexdigest()}.png"
         path = os.path.join(output_dir, fname)
-        bg.save(path)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(data)
         return fname
 
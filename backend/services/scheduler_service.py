@@ -1,181 +1,407 @@
-import time
 import os
+import logging
+import queue
+import sys
+import hashlib
+import orjson
+import asyncio
+import threading
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from services import arxiv_cache
+from services.backups import backup_file
 from services.arxiv_fetcher import ArxivFetcher
 from services.gemini_agent import GeminiAgent
+from services.llm_cache import LLMCache
 from services.user_profile_manager import UserProfileManager
-from services.newspaper_layout import NewspaperLayout
-from services.html_digest_renderer import render_from_latest
 from datetime import datetime
+from typing import Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Queue handler/listener pair installed by _start_logging, if any
+_log_queue: Optional[Tuple[QueueHandler, QueueListener]] = None
+_log_queue_lock = threading.Lock()
+
+def _start_logging():
+    """
+    Makes this module's INFO records visible. If the app has configured the root logger, records simply
+    propagate to it. Otherwise they are written to stdout by a QueueListener on its own thread, so digest
+    workers never block on console I/O. Propagation stays on either way.
+    """
+    global _log_queue
+    logger.setLevel(logging.INFO)
+    with _log_queue_lock:
+        if _log_queue is not None or logging.getLogger().handlers:
+            return
+        log_queue = queue.SimpleQueue()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+        queue_handler = QueueHandler(log_queue)
+        listener = QueueListener(log_queue, handler)
+        listener.start()
+        logger.addHandler(queue_handler)
+        _log_queue = (queue_handler, listener)
+
+def _stop_logging():
+    global _log_queue
+    with _log_queue_lock:
+        if _log_queue is None:
+            return
+        queue_handler, listener = _log_queue
+        # Detach first so records from threads still running fall back to the root logger,
+        # then stop, which drains what was already queued
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        _log_queue = None
+
+# arXiv asks automated clients to keep request rates low, so cap concurrent searches
+ARXIV_CONCURRENCY = 3
+
+# arXiv's API terms ask for no more than one request every three seconds; searches still
+# overlap while waiting on responses, but their starts are spaced this far apart
+ARXIV_REQUEST_INTERVAL = 3.0
+
+# arXiv categories digest papers must belong to, so results don't drift into unrelated fields.
+# Matched locally against each paper's categories rather than ANDed into the arXiv query.
+DIGEST_CATEGORIES = frozenset({"cs.CL", "cs.AI", "cs.LG", "cs.CV", "cs.SE"})
+
+# Papers kept per query, and how many are fetched per query to leave room for the category filter
+PAPERS_PER_QUERY = 2
+FETCH_PER_QUERY = 6
+
+# Per-attempt limit on the digest's Gemini calls (summaries, prompt, hero and thumbnails), so a hung call can't stall a run.
+# Each call is retried at most twice, 1 s then 4 s apart, so one call takes at most about 3 minutes;
+# a thumbnail that still fails is left out.
+DIGEST_CALL_TIMEOUT = 60
+
+# Threads for the digest's blocking Gemini calls (per-article thumbnails), shared across runs
+DIGEST_IO_WORKERS = 8
 
 class SchedulerService:
-    def __init__(self, gemini_agent: GeminiAgent, profile_manager: UserProfileManager):
-        self.scheduler = BackgroundScheduler()
+    def __init__(self, gemini_agent: GeminiAgent, profile_manager: UserProfileManager, categories=DIGEST_CATEGORIES):
+        # Run late rather than skip: a digest missed while the machine slept still gets made, once
+        self.scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": None, "coalesce": True, "max_instances": 1})
         self.gemini_agent = gemini_agent
         self.profile_manager = profile_manager
         self.output_dir = "uploads/daily_digests"
+        self.output_base_url = f"{settings().public_base_url.rstrip('/')}/uploads/daily_digests"
         os.makedirs(self.output_dir, exist_ok=True)
 
+        self.categories = frozenset(categories)
+
+        # Thumbnail prompt -> generated filename, so papers that stay in the digest
+        # for several days don't get a new image each time
+        self._thumbnail_cache = LLMCache()
+
+        _start_logging()
+
+        # Long-lived so runs don't pay for thread start-up; shut down in stop()
+        self._io_pool = ThreadPoolExecutor(max_workers=DIGEST_IO_WORKERS, thread_name_prefix="digest-io")
+
+        # Serializes digest publishes; thumbnails finishing on pool threads each trigger one
+        self._publish_lock = threading.Lock()
+        # The run whose thumbnails may still update the published digest
+        self._current_run: Optional[dict] = None
+
     def start(self):
         # Schedule daily task at 8:00 AM
-        # Added misfire_grace_time=3600 (1 hour) to handle cases where the machine was sleeping
         trigger = CronTrigger(hour=8, minute=0)
-        self.scheduler.add_job(self.run_daily_digest, trigger, misfire_grace_time=3600)
+        self.scheduler.add_job(self.run_daily_digest, trigger, id="daily_digest", replace_existing=True)
         self.scheduler.start()
-        print("Scheduler started. Daily Digest scheduled for 08:00.")
+        logger.info("Scheduler started. Daily Digest scheduled for 08:00.")
 
-        # Catch-up mechanism: Check if today's digest is missing and it's past 8 AM
+        # Catch-up mechanism: Check if today's digest is missing and it's past 8 AM.
+        # Still needed with misfire_grace_time=None: jobs live in memory, so a run missed while the process was down is never seen as a misfire.
         self._check_and_run_catchup()
 
+    def stop(self):
+        """
+        Stops the scheduler and drops queued thumbnail work. Calls already in flight are left to finish on their own.
+        """
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
+        _stop_logging()
+
+    def _has_todays_digest(self) -> bool:
+        """
+        True if latest_digest.json is dated today and its composite image is still on disk.
+        """
+        try:
+            with open("data/latest_digest.json", "rb") as f:
+                meta = orjson.loads(f.read())
+        except Exception:
+            return False
+        if meta.get("date") != datetime.now().strftime("%Y-%m-%d"):
+            return False
+        composite_name = os.path.basename(meta.get("image_url") or "")
+        return bool(composite_name) and os.path.exists(os.path.join(self.output_dir, composite_name))
+
     def _check_and_run_catchup(self):
         try:
-            today_str = datetime.now().strftime("%Y-%m-%d")
-            digest_path = "data/latest_digest.json"
-            
-            should_run = False
-            
-            # Check if digest file exists and matches today
-            if not os.path.exists(digest_path):
-                should_run = True
-            else:
-                try:
-                    import json
-                    with open(digest_path, "r") as f:
-                        meta = json.load(f)
-                        if meta.get("date") != today_str:
-                            should_run = True
-                except Exception:
-                    should_run = True
-            
-            # Check if it's past 8:00 AM
+            # Check if it's past 8:00 AM and today's digest is missing
             now = datetime.now()
-            if should_run and now.hour >= 8:
-                print(f"[{now}] Catch-up: Daily Digest for {today_str} is missing. Triggering now...")
+            if now.hour >= 8 and not self._has_todays_digest():
+                logger.info("Catch-up: Daily Digest for %s is missing. Triggering now...", now.strftime("%Y-%m-%d"))
                 # Run immediately in background
                 self.scheduler.add_job(self.run_daily_digest)
         except Exception as e:
-            print(f"Error in catch-up check: {e}")
+            logger.error("Error in catch-up check: %s", e)
+
+    async def _search_arxiv(self, queries: list[str], max_results: int, days_back: int):
+        # This runs on the scheduler thread under its own event loop, so it can't share the app's client.
+        # All queries go out on one pooled client, at most ARXIV_CONCURRENCY at a time.
+        semaphore = asyncio.Semaphore(ARXIV_CONCURRENCY)
+        pacing = asyncio.Lock()
+        next_start = 0.0
+
+        async with ArxivFetcher.new_client() as client:
+            async def search_one(query: str):
+                nonlocal next_start
+                async with semaphore:
+                    async with pacing:
+                        loop = asyncio.get_running_loop()
+                        delay = next_start - loop.time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        next_start = loop.time() + ARXIV_REQUEST_INTERVAL
+                    return await ArxivFetcher.search_papers(query, max_results=max_results, days_back=days_back, client=client)
+
+            async def cached_search(query: str):
+                # Catch-up runs and manual triggers repeat the same queries within a day
+                key = arxiv_cache.cache_key(query, max_results, days_back)
+                return await arxiv_cache.get_or_fetch(key, lambda: search_one(query))
+
+            return await asyncio.gather(*(cached_search(q) for q in queries))
+
+    def _render_thumbnail(self, card, items_dir: str):
+        try:
+            article_prompt = self.gemini_agent.generate_article_prompt(asdict(card))
+        except Exception as _:
+            return None
+
+        key = "thumbnail:" + hashlib.sha1(article_prompt.encode("utf-8")).hexdigest()
+        try:
+            cached = self._thumbnail_cache.get(key)
+        except Exception as e:
+            logger.warning("Error reading thumbnail cache: %s", e)
+            cached = None
+        if cached is not None:
+            thumb_path = os.path.join(items_dir, cached["filename"])
+            if os.path.exists(thumb_path):
+                return thumb_path
 
-    def run_daily_digest(self):
-        print(f"[{datetime.now()}] Starting Daily Digest generation...")
+        try:
+            thumb_name = self.gemini_agent.generate_poster_image(article_prompt, output_dir=items_dir, timeout=DIGEST_CALL_TIMEOUT)
+        except Exception as _:
+            return None
+        try:
+            self._thumbnail_cache.set(key, {"filename": thumb_name})
+        except Exception as e:
+            logger.warning("Error saving thumbnail cache: %s", e)
+        return os.path.join(items_dir, thumb_name)
+
+    def _publish_digest(self, run: dict):
+        """
+        Composes the newspaper image for `run` from the thumbnails generated so far, then rewrites
+        latest_digest.json and digest.html. Runs once when the hero image is ready and again as each thumbnail lands.
+        """
+        # Imported here rather than at module load: PIL, NumPy and the Jinja renderer are only
+        # needed once a day, so the API process doesn't pay for them at startup
+        from services.newspaper_layout import NewspaperLayout
+        from services.html_digest_renderer import render_from_latest
+
+        with self._publish_lock:
+            # A newer run has taken over; its digest must not be overwritten by our late thumbnails
+            if self._current_run is not run:
+                return
+
+            article_cards = run["cards"]
+            composite_name = NewspaperLayout.render_digest(
+                title="Daily Scholar Digest",
+                date_text=run["date"],
+                hero_image_path=run["hero_path"],
+                articles=article_cards,
+                output_dir=self.output_dir
+            )
+            
+            # Save metadata about this digest
+            digest_meta = {
+                "date": run["date"],
+                "image_url": f"{self.output_base_url}/{composite_name}",
+                "papers": run["papers"],
+                "items": [
+                    {
+                        "paper_id": c.paper_id,
+                        "title": c.title,
+                        "summary": c.summary,
+                        "authors": c.authors,
+                        "image_url": (
+                            f"{self.output_base_url}/items/{os.path.basename(c.image_path)}"
+                            if c.image_path else None
+                        )
+                    } for c in article_cards
+                ]
+            }
+            
+            # Save latest digest info to a JSON file for frontend to fetch
+            # Write to a temp file and rename so readers never see a half-written digest.
+            # Serialized in memory first and written in one buffered call; the file is machine-read only.
+            with open("data/latest_digest.json.tmp", "wb", buffering=65536) as f:
+                f.write(orjson.dumps(digest_meta))
+            if run.get("composite_name") is None:
+                # Keep the digest this run replaces; later thumbnail republishes only refine our own
+                backup_file("data/latest_digest.json")
+            os.replace("data/latest_digest.json.tmp", "data/latest_digest.json")
+
+            try:
+                render_from_latest("data/latest_digest.json", os.path.join(self.output_dir, "digest.html"))
+            except Exception as _:
+                pass
+
+            # Each publish with more thumbnails produces a new composite. The earlier ones are kept:
+            # pages that already fetched the digest still point at them
+            run["composite_name"] = composite_name
+            return composite_name
+
+    def _on_thumbnail(self, run: dict, card, future):
+        try:
+            card.image_path = future.result()
+        except Exception as _:
+            card.image_path = None
+        if card.image_path is None or "hero_path" not in run:
+            # Nothing new to show, or the first publish will pick it up
+            return
+        try:
+            self._publish_digest(run)
+        except Exception as e:
+            logger.error("Error updating Daily Digest with thumbnail: %s", e)
+
+    def run_daily_digest(self, force: bool = False):
+        """
+        Builds and publishes today's digest. Does nothing if today's digest already exists, unless `force` is set,
+        so duplicate fires and repeated manual triggers don't pay for the Gemini calls again.
+        """
+        if not force and self._has_todays_digest():
+            logger.info("Daily Digest for today already exists, skipping.")
+            return
+
+        # Lives with the layout, so like it is only imported once a digest actually runs
+        from services.newspaper_layout import ArticleCard
+
+        logger.info("Starting Daily Digest generation...")
         try:
             # 1. Get User Interests
             profile = self.profile_manager.get_profile()
             queries = profile.get("suggested_queries", [])
             
             if not queries:
-                print("No user interests found. Skipping Daily Digest.")
+                logger.info("No user interests found. Skipping Daily Digest.")
                 return
 
             # 2. Search Papers (Last 24h)
-            all_papers = []
             # Increase days_back to 30 to ensure we find something for testing purposes if today's yield is low
             days_search = 30 
-            for query in queries[:3]: # Limit to top 3 queries to save API calls
-                # Enhance query to target Computer Science categories and avoid irrelevant fields
-                # We wrap the original query in parentheses and AND it with the category filter
-                enhanced_query = f"({query}) AND (cat:cs.CL OR cat:cs.AI OR cat:cs.LG OR cat:cs.CV OR cat:cs.SE)"
-                
-                print(f"Searching for: {enhanced_query} (past {days_search} days)")
-                papers = ArxivFetcher.search_papers(enhanced_query, max_results=2, days_back=days_search)
-                all_papers.extend(papers)
+            search_queries = queries[:3] # Limit to top 3 queries to save API calls
+            for query in search_queries:
+                logger.info("Searching for: %s (past %s days)", query, days_search)
+
+            # Results come back in query order, so the dedupe below still prefers earlier queries.
+            # Over-fetch, then keep the first few papers in our categories to avoid irrelevant fields.
+            results = asyncio.run(self._search_arxiv(search_queries, max_results=FETCH_PER_QUERY, days_back=days_search))
+            all_papers = []
+            for papers in results:
+                relevant = [p for p in papers if not self.categories.isdisjoint(p.categories)]
+                all_papers.extend(relevant[:PAPERS_PER_QUERY])
             
             if not all_papers:
-                print("No new papers found today.")
+                logger.info("No new papers found today.")
                 return
 
-            # Deduplicate by ID
-            unique_papers = {p.id: p for p in all_papers}.values()
-            top_papers = list(unique_papers)[:5] # Take top 5
+            # Deduplicate by ID, stopping once we have the top 5
+            seen = set()
+            top_papers = []
+            for p in all_papers:
+                if p.id in seen:
+                    continue
+                seen.add(p.id)
+                top_papers.append(p)
+                if len(top_papers) == 5:
+                    break
             
-            print(f"Found {len(top_papers)} relevant papers.")
+            logger.info("Found %d relevant papers.", len(top_papers))
 
             # 3. Summarize for Prompt + Per-article summaries
-            summary_text = ""
+            # All abstracts go out in one Gemini request. API failures come back as error summaries;
+            # the abstract fallback below only covers a call that raises outright.
+            try:
+                summaries = self.gemini_agent.summarize_texts_batch(
+                    [p.abstract for p in top_papers], timeout=DIGEST_CALL_TIMEOUT
+                )
+            except Exception as _:
+                summaries = [None] * len(top_papers)
+
+            summary_lines = []
             article_cards = []
-            for i, p in enumerate(top_papers):
-                summary_text += f"{i+1}. {p.title}: {p.abstract[:200]}...\n"
+            for i, (p, s) in enumerate(zip(top_papers, summaries)):
+                # Sliced once per paper; the fallback blurb is a prefix of the prompt excerpt
+                excerpt = p.abstract[:200]
+                fallback_summary = excerpt[:180] + "..."
+                summary_lines.append(f"{i+1}. {p.title}: {excerpt}...\n")
 
-                # Generate structured summary from abstract (fast path)
-                try:
-                    s = self.gemini_agent.summarize_text(p.abstract)
-                except Exception as _:
+                if s is None:
                     s = {
                         "title": p.title,
-                        "one_sentence_summary": p.abstract[:180] + "...",
+                        "one_sentence_summary": fallback_summary,
                         "key_innovations": [],
                         "design_theme": {"accent_color": "#1f2937", "highlight_bg": "#f3f4f6"}
                     }
-                article_cards.append({
-                    "paper_id": p.id,
-                    "title": s.get("title", p.title),
-                    "summary": s.get("one_sentence_summary", p.abstract[:180] + "..."),
-                    "authors": ", ".join(p.authors[:3]),
-                    "design_theme": s.get("design_theme", {}),
-                })
+                article_cards.append(ArticleCard(
+                    paper_id=p.id,
+                    title=s.get("title", p.title),
+                    summary=s.get("one_sentence_summary", fallback_summary),
+                    authors=", ".join(p.authors[:3]),
+                    design_theme=s.get("design_theme", {}),
+                ))
+
+            summary_text = "".join(summary_lines)
 
             # 4. Generate Prompt
-            prompt = self.gemini_agent.generate_daily_digest_prompt(summary_text)
+            prompt = self.gemini_agent.generate_daily_digest_prompt(summary_text, timeout=DIGEST_CALL_TIMEOUT)
             
-            # 5. Generate Hero Image
-            hero_filename = self.gemini_agent.generate_poster_image(prompt, output_dir=self.output_dir)
-            hero_path = os.path.join(self.output_dir, hero_filename)
-
-            # 6. Generate per-article thumbnails
+            # 5. + 6. Start the per-article thumbnails in the background, then generate the hero image.
+            # The digest is published as soon as the hero is ready and republished as each thumbnail lands,
+            # so readers don't wait on all the image generations.
             items_dir = os.path.join(self.output_dir, "items")
             os.makedirs(items_dir, exist_ok=True)
-            for card in article_cards:
-                try:
-                    article_prompt = self.gemini_agent.generate_article_prompt(card)
-                    thumb_name = self.gemini_agent.generate_poster_image(article_prompt, output_dir=items_dir)
-                    card["image_path"] = os.path.join(items_dir, thumb_name)
-                except Exception as _:
-                    card["image_path"] = None
-
-            # 7. Compose newspaper-style layout
-            composite_name = NewspaperLayout.render_digest(
-                title="Daily Scholar Digest",
-                date_text=datetime.now().strftime("%Y-%m-%d"),
-                hero_image_path=hero_path,
-                articles=article_cards,
-                output_dir=self.output_dir
-            )
-            
-            # Save metadata about this digest
-            digest_meta = {
+            run = {
                 "date": datetime.now().strftime("%Y-%m-%d"),
-                "image_url": f"http://127.0.0.1:8000/uploads/daily_digests/{composite_name}",
                 "papers": [{"id": p.id, "title": p.title} for p in top_papers],
-                "items": [
-                    {
-                        "paper_id": c["paper_id"],
-                        "title": c["title"],
-                        "summary": c["summary"],
-                        "authors": c["authors"],
-                        "image_url": (
-                            f"http://127.0.0.1:8000/uploads/daily_digests/items/{os.path.basename(c['image_path'])}"
-                            if c.get("image_path") else None
-                        )
-                    } for c in article_cards
-                ]
+                "cards": article_cards,
             }
-            
-            # Save latest digest info to a JSON file for frontend to fetch
-            with open("data/latest_digest.json", "w") as f:
-                import json
-                json.dump(digest_meta, f)
+            with self._publish_lock:
+                self._current_run = run
 
-            try:
-                render_from_latest("data/latest_digest.json", os.path.join(self.output_dir, "digest.html"))
-            except Exception as _:
-                pass
+            for card in article_cards:
+                future = self._io_pool.submit(self._render_thumbnail, card, items_dir)
+                future.add_done_callback(lambda f, card=card: self._on_thumbnail(run, card, f))
+
+            hero_filename = self.gemini_agent.generate_poster_image(prompt, output_dir=self.output_dir, timeout=DIGEST_CALL_TIMEOUT)
+            run["hero_path"] = os.path.join(self.output_dir, hero_filename)
+
+            # 7. Compose newspaper-style layout and publish
+            composite_name = self._publish_digest(run)
 
-            print(f"Daily Digest generated successfully: {composite_name}")
+            logger.info("Daily Digest generated successfully: %s", composite_name)
 
         except Exception as e:
-            print(f"Error generating Daily Digest: {e}")
+            logger.error("Error generating Daily Digest: %s", e)
 
-    def trigger_now(self):
-        """Manually trigger for testing"""
-        self.scheduler.add_job(self.run_daily_digest)
+    def trigger_now(self, force: bool = False):
+        """Manually trigger for testing; `force` regenerates even if today's digest exists"""
+        self.scheduler.add_job(self.run_daily_digest, kwargs={"force": force})
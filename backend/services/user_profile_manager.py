@@ -1,34 +1,89 @@
-import json
+import atexit
 import os
-from typing import List, Dict, Any, Optional
+import threading
+import orjson
+from services.backups import backup_file
+from typing import List, Dict, Any, Optional, Tuple
+
+# Saves arriving within this window are coalesced into a single write
+SAVE_DEBOUNCE_SECONDS = 0.5
 
 class UserProfileManager:
     def __init__(self, storage_file: str = "data/user_profile.json"):
         self.storage_file = storage_file
+        # (mtime_ns, profile) of the last read, reused while the file is unchanged
+        self._cached: Optional[Tuple[int, Dict[str, Any]]] = None
+
+        # Latest unsaved profile and the timer that will write it
+        self._pending: Optional[Dict[str, Any]] = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        atexit.register(self._flush)
+
         self.ensure_storage_exists()
         
     def ensure_storage_exists(self):
         os.makedirs(os.path.dirname(self.storage_file), exist_ok=True)
         if not os.path.exists(self.storage_file):
-            with open(self.storage_file, "w") as f:
-                json.dump({"suggested_queries": [], "research_directions": []}, f)
+            with open(self.storage_file, "wb") as f:
+                f.write(orjson.dumps({"suggested_queries": [], "research_directions": []}))
 
     def save_profile(self, suggested_queries: List[str], research_directions: List[str]):
-        """Saves user research interests to JSON file."""
+        """
+        Saves user research interests to JSON file.
+        The write is deferred by SAVE_DEBOUNCE_SECONDS so a burst of saves results in one write of the latest profile;
+        get_profile sees the new profile immediately.
+        """
         data = {
             "suggested_queries": suggested_queries,
             "research_directions": research_directions,
             "updated_at": os.path.getmtime(self.storage_file) if os.path.exists(self.storage_file) else 0
         }
-        with open(self.storage_file, "w") as f:
-            json.dump(data, f, indent=4)
+        with self._lock:
+            self._pending = data
+            if self._timer is not None:
+                self._timer.cancel()
+            # Daemon so a pending timer doesn't hold up interpreter exit; atexit flushes instead
+            self._timer = threading.Timer(SAVE_DEBOUNCE_SECONDS, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            data = self._pending
+            if data is None:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            # Write to a temp file and rename so a crash mid-write never truncates the profile
+            tmp_path = f"{self.storage_file}.tmp"
+            # Still indented since the profile is meant to be hand-editable
+            with open(tmp_path, "wb", buffering=65536) as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            backup_file(self.storage_file)
+            os.replace(tmp_path, self.storage_file)
+            self._cached = None
+            self._pending = None
         print(f"User profile saved to {self.storage_file}")
 
     def get_profile(self) -> Dict[str, Any]:
-        """Loads user research interests."""
+        """Loads user research interests, re-reading the file only when its mtime changes."""
+        pending = self._pending
+        if pending is not None:
+            return dict(pending)
+
         try:
-            with open(self.storage_file, "r") as f:
-                return json.load(f)
+            mtime = os.stat(self.storage_file).st_mtime_ns
+            cached = self._cached
+            if cached is not None and cached[0] == mtime:
+                return dict(cached[1])
+
+            with open(self.storage_file, "rb") as f:
+                profile = orjson.loads(f.read())
+            self._cached = (mtime, profile)
+            return dict(profile)
         except Exception as e:
             print(f"Error loading profile: {e}")
             return {"suggested_queries": [], "research_directions": []}